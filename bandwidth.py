@@ -0,0 +1,110 @@
+import threading
+import time
+import random
+
+
+class TokenBucket:
+    """
+    Lớp này giới hạn tốc độ truyền bằng thuật toán token bucket (đơn vị: byte/giây).
+    Token có thể âm: một lần truyền lớn hơn dung lượng bucket vẫn được phép, nhưng các lần sau phải chờ bù.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Khởi tạo bucket.
+        :param rate: Bytes per second; 0 or None disables the limit.
+        :param burst: Bucket capacity in bytes; defaults to one second of traffic.
+        """
+        self.rate = rate or 0
+        self.capacity = burst or self.rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Trừ `amount` token và trả về số giây cần chờ trước khi được truyền.
+        """
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+def reserve_all(buckets, amount):
+    """
+    Trừ token ở mọi bucket (bỏ qua None) và trả về thời gian chờ lâu nhất.
+    """
+    return max((bucket.reserve(amount) for bucket in buckets if bucket is not None), default=0.0)
+
+
+def throttle(buckets, amount):
+    """
+    Chờ cho đến khi mọi bucket cho phép truyền `amount` byte.
+    """
+    delay = reserve_all(buckets, amount)
+    if delay:
+        time.sleep(delay)
+
+
+class UploadSlots:
+    """
+    Lớp này giới hạn số peer được tải lên cùng lúc và luân phiên các slot theo kiểu choke/unchoke:
+    sau mỗi chu kỳ, các slot thường dành cho những peer đã gửi cho ta nhiều dữ liệu nhất (có qua có lại),
+    cộng một slot "lạc quan" cho một peer ngẫu nhiên khác để peer mới có cơ hội.
+    """
+    def __init__(self, slots, interval, contributions):
+        """
+        Khởi tạo bộ quản lý slot.
+        :param slots: Number of peers that may download from us at the same time.
+        :param interval: Seconds between choke/unchoke rounds.
+        :param contributions: Callable () -> {peer: bytes received from that peer since the last round}.
+        """
+        self.slots = max(1, slots)
+        self.interval = interval
+        self.contributions = contributions
+        self.unchoked = set()
+        self.interested = {}
+        self.last_round = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self, peer):
+        """
+        Kiểm tra peer có được tải lên hay không; peer mới được nhận khi còn slot trống.
+        :return: 0 if the peer is unchoked, otherwise seconds until the next unchoke round.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.interested[peer] = now
+            if now - self.last_round >= self.interval:
+                self._rotate(now)
+            if peer in self.unchoked:
+                return 0
+            if len(self.unchoked) < self.slots:
+                self.unchoked.add(peer)
+                return 0
+            return self.last_round + self.interval - now
+
+    def release(self, peer):
+        """
+        Giải phóng slot của một peer đã ngắt kết nối.
+        """
+        with self.lock:
+            self.interested.pop(peer, None)
+            self.unchoked.discard(peer)
+
+    def _rotate(self, now):
+        for peer, last_request in list(self.interested.items()):
+            if now - last_request > 2 * self.interval:
+                del self.interested[peer]
+        contributions = self.contributions()
+        ranked = sorted(self.interested, key=lambda peer: contributions.get(peer, 0), reverse=True)
+        regular = ranked[:self.slots - 1]
+        others = ranked[self.slots - 1:]
+        self.unchoked = set(regular)
+        if others:
+            self.unchoked.add(random.choice(others))
+        self.last_round = now
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_kb():
+    """
+    Bộ nhớ thường trú cao nhất của tiến trình hiện tại (KB), hoặc None nếu hệ điều hành không hỗ trợ.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class ThreadSampler:
+    """
+    Lớp này định kỳ đếm số luồng đang chạy trong tiến trình và giữ lại giá trị lớn nhất.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def stop(self):
+        self.stopped.set()
+        return max(self.peak, threading.active_count())
+
+
+def percentile(values, fraction):
+    """
+    Phân vị của một danh sách giá trị (nội suy tuyến tính), hoặc None nếu danh sách rỗng.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def generate_file(path, size, seed, content):
+    """
+    Tạo một tệp tổng hợp có nội dung xác định theo `seed`.
+    :param content: "random" for incompressible bytes, "text" for CSV-like rows.
+    :return: MD5 of the file content.
+    """
+    generator = random.Random(seed)
+    digest = hashlib.md5()
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            count = min(1024 * 1024, size - written)
+            if content == "text":
+                rows = []
+                length = 0
+                while length < count:
+                    row = f"{generator.randrange(10 ** 9)},user{generator.randrange(1000)},{generator.random():.6f}\n"
+                    rows.append(row)
+                    length += len(row)
+                block = "".join(rows).encode()[:count]
+            else:
+                block = generator.randbytes(count)
+            f.write(block)
+            digest.update(block)
+            written += count
+    return digest.hexdigest()
+
+
+def tracker_process(port, workdir, stop_event, results, log_level):
+    """
+    Chạy tracker trong tiến trình riêng và báo số yêu cầu theo action (từ metrics của tracker) khi được yêu cầu dừng.
+    """
+    os.chdir(workdir)
+    from tracker import Tracker
+    logging.getLogger().setLevel(log_level)
+
+    tracker = Tracker("127.0.0.1", port)
+    sampler = ThreadSampler()
+    threading.Thread(target=tracker.start, daemon=True).start()
+    stop_event.wait()
+    counts = {
+        dict(labels)["action"]: value
+        for (name, labels), value in list(tracker.metrics.counters.items()) if name == "requests_total"
+    }
+    results.put({
+        "role": "tracker", "requests": sum(counts.values()), "actions": counts,
+        "peak_threads": sampler.stop(), "peak_rss_kb": peak_rss_kb()
+    })
+
+
+def seeder_process(index, port, tracker_port, workdir, paths, ready, stop_event, results, log_level):
+    """
+    Chạy một peer chia sẻ sẵn các tệp tổng hợp cho đến khi được yêu cầu dừng.
+    """
+    os.chdir(workdir)
+    from peer import Peer
+    logging.getLogger().setLevel(log_level)
+
+    peer = Peer("127.0.0.1", port, "127.0.0.1", tracker_port)
+    sampler = ThreadSampler()
+    registered = peer.register_files(paths)
+    threading.Thread(target=peer.start, daemon=True).start()
+    ready.put((index, len(registered)))
+    stop_event.wait()
+    peer.stop()
+    results.put({
+        "role": "seeder", "index": index, "peak_threads": sampler.stop(), "peak_rss_kb": peak_rss_kb(),
+        "cache": peer.chunk_cache.stats()
+    })
+
+
+def leecher_process(index, port, tracker_port, workdir, files, ready, start_event, results, log_level):
+    """
+    Chạy một peer tải đồng thời mọi tệp tổng hợp, đo thời gian hoàn tất và kiểm tra nội dung từng tệp.
+    Mỗi lượt tải có một luồng chờ riêng ghi lại thời điểm nó kết thúc, không phụ thuộc thứ tự join.
+    :param files: Dictionary {filename: (size, md5)}.
+    """
+    os.chdir(workdir)
+    from peer import Peer
+    logging.getLogger().setLevel(log_level)
+
+    peer = Peer("127.0.0.1", port, "127.0.0.1", tracker_port)
+    sampler = ThreadSampler()
+    threading.Thread(target=peer.start, daemon=True).start()
+    ready.put((index, 0))
+    start_event.wait()
+
+    started = time.monotonic()
+    downloads = {}
+    durations = {}
+    waiters = []
+
+    def wait_for(filename, thread):
+        if thread is not None:
+            thread.join()
+        durations[filename] = time.monotonic() - started
+
+    for filename in files:
+        response = peer.query_peers(filename)
+        save_path = os.path.join(workdir, "downloads", filename)
+        peer.download_file(filename, response.get("peers", []), save_path)
+        downloads[filename] = save_path
+        waiter = threading.Thread(target=wait_for, args=(filename, peer.active_downloads.get(filename)), daemon=True)
+        waiter.start()
+        waiters.append(waiter)
+    for waiter in waiters:
+        waiter.join()
+
+    downloaded = []
+    for filename, save_path in downloads.items():
+        size, md5 = files[filename]
+        with open(save_path, "rb") as f:
+            valid = hashlib.md5(f.read()).hexdigest() == md5 if os.path.getsize(save_path) == size else False
+        downloaded.append({"filename": filename, "seconds": durations[filename], "bytes": size, "valid": valid})
+    peer.stop()
+    results.put({
+        "role": "leecher", "index": index, "downloads": downloaded,
+        "peak_threads": sampler.stop(), "peak_rss_kb": peak_rss_kb()
+    })
+
+
+def run_benchmark(args):
+    """
+    Dựng một swarm trên 127.0.0.1 (một tracker, các seeder và leecher trong tiến trình riêng),
+    cho mọi leecher tải đồng thời các tệp tổng hợp và tổng hợp kết quả.
+    :return: Result dictionary.
+    """
+    root = tempfile.mkdtemp(prefix="p2p-bench-")
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    start_event = context.Event()
+    ready = context.Queue()
+    results = context.Queue()
+    processes = []
+    log_level = getattr(logging, args.log_level.upper())
+
+    try:
+        source_dir = os.path.join(root, "source")
+        os.makedirs(source_dir)
+        files = {}
+        paths = []
+        for number in range(args.files):
+            filename = f"bench{number}.bin"
+            path = os.path.join(source_dir, filename)
+            size = int(args.size_mb * 1024 * 1024)
+            files[filename] = (size, generate_file(path, size, args.seed + number, args.content))
+            paths.append(path)
+
+        def workdir(name):
+            path = os.path.join(root, name)
+            os.makedirs(path)
+            return path
+
+        tracker = context.Process(
+            target=tracker_process, args=(args.tracker_port, workdir("tracker"), stop_event, results, log_level)
+        )
+        tracker.start()
+        processes.append(tracker)
+        time.sleep(args.startup_delay)
+
+        port = args.base_port
+        for index in range(args.seeders):
+            process = context.Process(target=seeder_process, args=(
+                index, port, args.tracker_port, workdir(f"seeder{index}"), paths, ready, stop_event, results, log_level
+            ))
+            process.start()
+            processes.append(process)
+            port += 1
+        for _ in range(args.seeders):
+            ready.get(timeout=args.timeout)
+
+        leechers = []
+        for index in range(args.leechers):
+            process = context.Process(target=leecher_process, args=(
+                index, port, args.tracker_port, workdir(f"leecher{index}"), files, ready, start_event, results,
+                log_level
+            ))
+            process.start()
+            processes.append(process)
+            leechers.append(process)
+            port += 1
+        for _ in range(args.leechers):
+            ready.get(timeout=args.timeout)
+
+        started = time.monotonic()
+        start_event.set()
+        reports = [results.get(timeout=args.timeout) for _ in range(args.leechers)]
+        elapsed = time.monotonic() - started
+
+        stop_event.set()
+        reports.extend(results.get(timeout=args.timeout) for _ in range(args.seeders + 1))
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    downloads = [download for report in reports if report["role"] == "leecher" for download in report["downloads"]]
+    seconds = [download["seconds"] for download in downloads]
+    total_bytes = sum(download["bytes"] for download in downloads)
+    tracker_report = next(report for report in reports if report["role"] == "tracker")
+
+    def role_summary(role):
+        role_reports = [report for report in reports if report["role"] == role]
+        rss = [report["peak_rss_kb"] for report in role_reports if report["peak_rss_kb"] is not None]
+        return {
+            "processes": len(role_reports),
+            "peak_threads": max(report["peak_threads"] for report in role_reports),
+            "peak_rss_kb": max(rss) if rss else None
+        }
+
+    return {
+        "config": {
+            "seeders": args.seeders, "leechers": args.leechers, "files": args.files,
+            "size_mb": args.size_mb, "content": args.content, "seed": args.seed
+        },
+        "elapsed_seconds": elapsed,
+        "downloads": len(downloads),
+        "failed_downloads": sum(1 for download in downloads if not download["valid"]),
+        "bytes_downloaded": total_bytes,
+        "throughput_mb_s": total_bytes / elapsed / (1024 * 1024) if elapsed else None,
+        "completion_seconds": {
+            "p50": percentile(seconds, 0.5), "p90": percentile(seconds, 0.9),
+            "p99": percentile(seconds, 0.99), "max": max(seconds, default=None)
+        },
+        "tracker": {
+            "requests": tracker_report["requests"],
+            "requests_per_second": tracker_report["requests"] / elapsed if elapsed else None,
+            "actions": tracker_report["actions"]
+        },
+        "tracker_process": role_summary("tracker"),
+        "seeder_processes": role_summary("seeder"),
+        "leecher_processes": role_summary("leecher"),
+        "seeder_cache": [report["cache"] for report in reports if report["role"] == "seeder"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback swarm benchmark for the P2P system")
+    parser.add_argument("--seeders", type=int, default=1, help="Number of seeding peer processes")
+    parser.add_argument("--leechers", type=int, default=4, help="Number of downloading peer processes")
+    parser.add_argument("--files", type=int, default=1, help="Number of synthetic files")
+    parser.add_argument("--size-mb", type=float, default=32, help="Size of each synthetic file in MiB")
+    parser.add_argument("--content", choices=("random", "text"), default="random", help="Synthetic file content")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic file content")
+    parser.add_argument("--tracker-port", type=int, default=16881, help="Tracker port")
+    parser.add_argument("--base-port", type=int, default=17000, help="First port used by peers")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for any benchmark step")
+    parser.add_argument("--startup-delay", type=float, default=1.0, help="Seconds to wait for the tracker to start")
+    parser.add_argument("--log-level", default="warning", help="Log level of the tracker and peers")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary working directory")
+    args = parser.parse_args()
+
+    result = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,136 @@
 # Configuration file for the P2P system
 
-TORRENT_MAX_SIZE_KB = 1024
\ No newline at end of file
+import os
+
+# Piece size is chosen per file: the smallest power of two between the minimum
+# and maximum that keeps the file under TORRENT_TARGET_PIECES pieces. Every piece
+# costs a scheduling, hash check and have round, so pieces are never below 1 MB.
+TORRENT_MIN_PIECE_SIZE_KB = 1024
+TORRENT_MAX_SIZE_KB = 16 * 1024
+TORRENT_TARGET_PIECES = 1024
+
+# Download scheduler: total concurrent chunk fetches per download, concurrent
+# fetches against a single peer, and failures before a peer is dropped.
+DOWNLOAD_MAX_WORKERS = 8
+DOWNLOAD_MAX_PER_PEER = 2
+DOWNLOAD_PEER_MAX_FAILURES = 3
+
+# Chunks are fetched in blocks of this size, pipelined on the connection and
+# split across up to DOWNLOAD_BLOCK_SOURCES peers holding the chunk.
+DOWNLOAD_BLOCK_SIZE_KB = 64
+DOWNLOAD_BLOCK_SOURCES = 2
+
+# Endgame: once this many chunks are outstanding, idle workers also request
+# them from other holders (up to DOWNLOAD_ENDGAME_MAX_SOURCES per chunk).
+DOWNLOAD_ENDGAME_CHUNKS = 4
+DOWNLOAD_ENDGAME_MAX_SOURCES = 3
+
+# Seconds between batched announces of newly downloaded chunks to the tracker.
+PEER_ANNOUNCE_INTERVAL = 1.0
+
+# Default seconds between heartbeats to the tracker (the tracker may ask for another interval).
+PEER_HEARTBEAT_INTERVAL = 60
+
+# Upload slots: peers served at once, seconds between choke/unchoke rounds,
+# and the minimum retry delay sent to peers that get a busy reply.
+PEER_UPLOAD_SLOTS = 4
+PEER_CHOKE_INTERVAL = 10
+PEER_BUSY_RETRY = 2
+
+# Bandwidth limits in bytes per second, globally and per connection (0 = unlimited).
+PEER_UPLOAD_RATE = 0
+PEER_UPLOAD_RATE_PER_CONNECTION = 0
+PEER_DOWNLOAD_RATE = 0
+PEER_DOWNLOAD_RATE_PER_CONNECTION = 0
+
+# Peer server: listen backlog, open connection limit, threads for disk work,
+# idle/write timeouts and how long shutdown waits for queued replies (seconds).
+PEER_BACKLOG = 1024
+PEER_MAX_CONNECTIONS = 1000
+PEER_DISK_WORKERS = 4
+PEER_IDLE_TIMEOUT = 300
+PEER_WRITE_TIMEOUT = 60
+PEER_SHUTDOWN_TIMEOUT = 5
+
+# In-memory LRU cache of chunks served to other peers (0 disables it and
+# serves every chunk with sendfile), and how many following chunks are read
+# ahead when a peer requests a file sequentially. Chunks larger than
+# 1/PEER_CACHE_MIN_CHUNKS of the cache are read block by block instead.
+PEER_CACHE_SIZE_MB = 64
+PEER_CACHE_PREFETCH = 2
+PEER_CACHE_MIN_CHUNKS = 16
+
+# Resumable downloads: directory of per-download state files and the minimum
+# seconds between two writes of a state file.
+PEER_DOWNLOAD_STATE_DIR = os.path.join("data", "downloads")
+PEER_DOWNLOAD_STATE_INTERVAL = 2
+
+# Optional compression of pieces on the peer wire: codecs offered, in order of
+# preference ("zlib", "lzma"; empty disables it). A chunk is compressed only if
+# a sample of it shrinks to at most PEER_COMPRESSION_MAX_RATIO of its size.
+PEER_COMPRESSION = ("zlib",)
+PEER_COMPRESSION_SAMPLE_KB = 4
+PEER_COMPRESSION_MAX_RATIO = 0.9
+# Chunks whose compressibility probe result is remembered.
+PEER_COMPRESSION_PROBES = 65536
+
+# Peer wire protocol timeouts in seconds.
+PEER_CONNECT_TIMEOUT = 10
+PEER_REQUEST_TIMEOUT = 30
+
+# Threads that verify piece hashes and write verified chunks, and the number
+# of failures charged to a peer that sends a chunk with a bad hash.
+DOWNLOAD_VERIFY_WORKERS = 2
+DOWNLOAD_CORRUPT_PENALTY = 2
+
+# Torrent creation: hashing threads, size of each sequential read, and the
+# on-disk cache of piece hashes keyed by path, size, mtime and inode.
+TORRENT_HASH_WORKERS = os.cpu_count() or 4
+TORRENT_HASH_READ_SIZE_KB = 16 * 1024
+TORRENT_HASH_CACHE = os.path.join("data", "hash_cache.json")
+
+# Tracker server: listen backlog, open connection limit, per-request timeout
+# in seconds and maximum request size.
+TRACKER_BACKLOG = 1024
+TRACKER_MAX_CONNECTIONS = 10000
+TRACKER_REQUEST_TIMEOUT = 10
+TRACKER_MAX_REQUEST_SIZE = 1024 * 1024
+
+# Seconds an idle persistent tracker session stays open.
+TRACKER_IDLE_TIMEOUT = 300
+
+# Peer-side tracker client: per-request timeout, attempts per request, and
+# the initial and maximum reconnect backoff in seconds.
+TRACKER_CLIENT_TIMEOUT = 10
+TRACKER_CLIENT_RETRIES = 3
+TRACKER_CLIENT_BACKOFF = 0.5
+TRACKER_CLIENT_MAX_BACKOFF = 30
+
+# Tracker list_files: default and maximum number of filenames per page.
+TRACKER_LIST_LIMIT = 1000
+TRACKER_LIST_MAX_LIMIT = 10000
+
+# Largest chunk count the tracker accepts for one file: a 16 TB file at the
+# maximum piece size. Bounds the per-file count array and per-peer bitfields.
+TRACKER_MAX_FILE_SIZE_GB = 16 * 1024
+TRACKER_MAX_CHUNKS = TRACKER_MAX_FILE_SIZE_GB * 1024 * 1024 // TORRENT_MAX_SIZE_KB
+
+# GUI: number of filenames fetched per page of the available files list.
+GUI_LIST_PAGE_SIZE = 200
+
+# Peer liveness: seconds without a heartbeat or announce before the tracker
+# evicts a peer, how often expiry runs, and how many distinct peers must report
+# a peer unreachable before it is evicted early.
+TRACKER_PEER_TTL = 180
+TRACKER_EXPIRY_INTERVAL = 5
+TRACKER_FAILURE_REPORTS = 3
+
+# Recent changes kept per file so conditional queries can be answered with a delta.
+TRACKER_DELTA_HISTORY = 256
+
+# Tracker persistence: snapshot file, append-only journal, and how often the
+# journal is compacted into a new snapshot (seconds or number of records).
+TRACKER_SNAPSHOT_FILE = "temp.json"
+TRACKER_JOURNAL_FILE = "tracker.journal"
+TRACKER_SNAPSHOT_INTERVAL = 60
+TRACKER_SNAPSHOT_RECORDS = 10000
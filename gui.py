@@ -7,7 +7,7 @@ from PyQt5.QtCore import Qt, QMetaObject, pyqtSignal
 import threading
 import logging
 import argparse
-import json
+from config import GUI_LIST_PAGE_SIZE
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -16,6 +16,7 @@ class P2PGUI(QMainWindow):
     Lớp này triển khai giao diện đồ họa (GUI) để tương tác với hệ thống P2P.
     """
     save_path_requested = pyqtSignal(str, name="savePathRequested")
+    files_page_loaded = pyqtSignal(int, list, object, bool, name="filesPageLoaded")
 
     def __init__(self, peer):
         """
@@ -28,8 +29,12 @@ class P2PGUI(QMainWindow):
         self.init_ui()
         self.download_progress_bars = {}
         self.download_status_labels = {}
+        self.files_request = 0
+        self.files_query = ""
+        self.files_cursor = None
 
         self.save_path_requested.connect(self.get_save_path)
+        self.files_page_loaded.connect(self.show_files_page)
 
     def init_ui(self):
         """
@@ -44,21 +49,32 @@ class P2PGUI(QMainWindow):
         self.shared_files_list = QListWidget()
         add_files_button = QPushButton("Add Files")
         add_files_button.clicked.connect(self.add_files)
+        add_folder_button = QPushButton("Add Folder")
+        add_folder_button.clicked.connect(self.add_folder)
 
         shared_files_layout = QVBoxLayout()
         shared_files_layout.addWidget(shared_files_label)
         shared_files_layout.addWidget(self.shared_files_list)
         shared_files_layout.addWidget(add_files_button)
+        shared_files_layout.addWidget(add_folder_button)
 
         available_files_label = QLabel("Available Files")
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search file names")
+        self.search_input.returnPressed.connect(self.refresh_available_files)
         self.available_files_list = QListWidget()
         refresh_button = QPushButton("Refresh")
         refresh_button.clicked.connect(self.refresh_available_files)
+        self.load_more_button = QPushButton("Load More")
+        self.load_more_button.setEnabled(False)
+        self.load_more_button.clicked.connect(self.load_more_files)
 
         available_files_layout = QVBoxLayout()
         available_files_layout.addWidget(available_files_label)
+        available_files_layout.addWidget(self.search_input)
         available_files_layout.addWidget(self.available_files_list)
         available_files_layout.addWidget(refresh_button)
+        available_files_layout.addWidget(self.load_more_button)
 
         download_button = QPushButton("Download Selected")
         download_button.clicked.connect(self.download_selected_files)
@@ -98,15 +114,26 @@ class P2PGUI(QMainWindow):
         """
         file_dialog = QFileDialog()
         file_paths, _ = file_dialog.getOpenFileNames(self, "Select Files to Share")
+        self.share_paths(file_paths)
 
+    def add_folder(self):
+        """
+        Chia sẻ cả một thư mục như một torrent duy nhất thông qua GUI.
+        """
+        folder_path = QFileDialog.getExistingDirectory(self, "Select Folder to Share")
+        if folder_path:
+            self.share_paths([folder_path])
+
+    def share_paths(self, file_paths):
+        """
+        Đăng ký các tệp hoặc thư mục với tracker trên một luồng nền và thêm vào danh sách chia sẻ.
+        """
         def process_files():
-            for file_path in file_paths:
-                try:
-                    filename = self.peer.register_file(file_path)
-                    if filename:
-                        self.shared_files_list.addItem(filename)
-                except Exception as e:
-                    logging.error(f"Exception occurred while adding file '{file_path}': {e}")
+            try:
+                for filename in self.peer.register_files(file_paths):
+                    self.shared_files_list.addItem(filename)
+            except Exception as e:
+                logging.error(f"Exception occurred while adding files {file_paths}: {e}")
 
         threading.Thread(target=process_files).start()
 
@@ -121,10 +148,8 @@ class P2PGUI(QMainWindow):
             if filename in self.download_progress_bars:
                 continue
 
-            response = self.peer.query_tracker(filename)
+            response = self.peer.query_peers(filename)
             if response.get("status") == "success":
-                peer_chunks = response.get("file_info", {})
-
                 progress_bar = QProgressBar()
                 status_label = QLabel(f"Status: Downloading {filename}")
                 self.download_manager_layout.addWidget(progress_bar)
@@ -147,11 +172,10 @@ class P2PGUI(QMainWindow):
         Bắt đầu tải xuống tệp được chọn.
         """
         try:
-            request = {"action": "query", "filename": filename}
-            response = self.peer.send_to_tracker(request)
-            file_info = json.loads(response).get("file_info", {})
+            response = self.peer.query_peers(filename)
+            peers = response.get("peers", [])
 
-            if not file_info:
+            if not peers:
                 return
 
             self.save_path = None
@@ -163,13 +187,13 @@ class P2PGUI(QMainWindow):
             if not self.save_path:
                 return
 
-            total_chunks = len(file_info)
+            total_chunks = response["total_chunks"]
             self.download_progress_bars[filename].setMaximum(total_chunks)
 
             def update_progress(current_chunks, total_chunks):
                 self.download_progress_bars[filename].setValue(current_chunks)
 
-            self.peer.download_file(filename, file_info, self.save_path, update_progress)
+            self.peer.download_file(filename, peers, self.save_path, update_progress)
 
             self.download_manager_layout.removeWidget(self.download_progress_bars[filename])
             self.download_manager_layout.removeWidget(self.download_status_labels[filename])
@@ -183,19 +207,57 @@ class P2PGUI(QMainWindow):
 
     def refresh_available_files(self):
         """
-        Làm mới danh sách các tệp có sẵn từ tracker.
+        Làm mới danh sách các tệp có sẵn: tải trang đầu tiên khớp với ô tìm kiếm.
         """
-        request = {"action": "list_files"}
-        response = self.peer.send_to_tracker(request)
+        self.files_query = self.search_input.text().strip()
+        self.load_files_page(None, append=False)
 
-        if response:
-            response_data = json.loads(response)
-            if response_data.get("status") == "success":
-                files = response_data.get("files", [])
-                self.available_files_list.clear()
-                for file in files:
-                    self.available_files_list.addItem(file)
+    def load_more_files(self):
+        """
+        Tải trang kế tiếp của danh sách các tệp có sẵn và thêm vào cuối danh sách.
+        """
+        if self.files_cursor is not None:
+            self.load_files_page(self.files_cursor, append=True)
 
+    def load_files_page(self, after, append):
+        """
+        Lấy một trang GUI_LIST_PAGE_SIZE tên tệp từ tracker trên một luồng nền;
+        kết quả được gửi về luồng giao diện qua tín hiệu files_page_loaded.
+        :param after: Cursor returned with the previous page, None for the first page.
+        :param append: Whether the page extends the list instead of replacing it.
+        """
+        self.files_request += 1
+        request = self.files_request
+        query = self.files_query
+        self.load_more_button.setEnabled(False)
+
+        def fetch_page():
+            try:
+                response_data = self.peer.list_files(contains=query or None, after=after, limit=GUI_LIST_PAGE_SIZE)
+            except Exception as e:
+                logging.error(f"Failed to list files from tracker: {e}")
+                response_data = {}
+            if response_data.get("status") != "success":
+                if response_data:
+                    logging.error(f"Tracker responded with an error for list_files: {response_data}")
+                self.files_page_loaded.emit(request, [], after, True)
+                return
+            self.files_page_loaded.emit(request, response_data.get("files", []), response_data.get("next"), append)
+
+        threading.Thread(target=fetch_page, daemon=True).start()
+
+    def show_files_page(self, request, files, cursor, append):
+        """
+        Hiển thị một trang tên tệp (chạy trên luồng giao diện); bỏ qua kết quả của yêu cầu đã cũ.
+        """
+        if request != self.files_request:
+            return
+        if not append:
+            self.available_files_list.clear()
+        for file in files:
+            self.available_files_list.addItem(file)
+        self.files_cursor = cursor
+        self.load_more_button.setEnabled(cursor is not None)
 
 def main():
     parser = argparse.ArgumentParser(description="GUI for P2P File Sharing System")
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import shutil
+import threading
+import logging
+from config import TRACKER_SNAPSHOT_INTERVAL, TRACKER_SNAPSHOT_RECORDS
+
+
+class TrackerJournal:
+    """
+    Lớp này lưu trạng thái tracker bằng nhật ký ghi thêm (write-ahead journal)
+    và các ảnh chụp (snapshot) được ghi nguyên tử ở nền.
+    Mỗi thay đổi chỉ tốn một dòng JSON nhỏ thay vì ghi lại toàn bộ trạng thái.
+    """
+    def __init__(self, snapshot_file, journal_file,
+                 snapshot_interval=TRACKER_SNAPSHOT_INTERVAL, snapshot_records=TRACKER_SNAPSHOT_RECORDS, metrics=None):
+        """
+        Khởi tạo journal.
+        :param snapshot_file: Path of the snapshot file.
+        :param journal_file: Path of the append-only journal.
+        :param snapshot_interval: Seconds between background snapshots.
+        :param snapshot_records: Journal records after which a snapshot is taken early.
+        :param metrics: Optional Metrics receiving the time spent writing journal records and snapshots.
+        """
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.rotated_file = f"{journal_file}.1"
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_records = snapshot_records
+        self.sequence = 0
+        self.snapshot_sequence = 0
+        self.records_since_snapshot = 0
+        self.file = None
+        self.lock = threading.Lock()
+        self.snapshot_requested = threading.Event()
+        self.metrics = metrics
+
+    def recover(self):
+        """
+        Khôi phục trạng thái: đọc snapshot và các bản ghi journal mới hơn snapshot.
+        :return: (files dictionary from the snapshot, list of journal records to replay).
+        """
+        files = {}
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, "r") as f:
+                    snapshot = json.load(f)
+                if "sequence" in snapshot and "files" in snapshot:
+                    self.sequence = snapshot["sequence"]
+                    files = snapshot["files"]
+                else:
+                    files = snapshot
+                logging.info(f"Loaded tracker snapshot from {self.snapshot_file} at sequence {self.sequence}.")
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to load tracker snapshot from {self.snapshot_file}: {e}")
+
+        self.snapshot_sequence = self.sequence
+        replay = []
+        for path in (self.rotated_file, self.journal_file):
+            replay.extend(self.read_records(path, repair=True))
+        return files, [record for record in replay if record["seq"] > self.sequence]
+
+    def read_records(self, path, repair=False):
+        """
+        Đọc các bản ghi trong một tệp journal, bỏ qua dòng cuối bị ghi dở khi tiến trình bị dừng đột ngột.
+        :param repair: Truncate the file after the last valid record, so that records appended later
+                       do not follow the torn fragment and get lost on the next recovery.
+        """
+        records = []
+        if not os.path.exists(path):
+            return records
+        valid_end = 0
+        terminated = True
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logging.warning(f"Ignoring truncated journal record in {path}.")
+                    break
+                valid_end += len(line)
+                terminated = line.endswith(b"\n")
+            size = f.seek(0, os.SEEK_END)
+        if repair and (valid_end < size or not terminated):
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+                if not terminated:
+                    f.seek(valid_end)
+                    f.write(b"\n")
+        return records
+
+    def open(self, apply, records):
+        """
+        Phát lại các bản ghi đã khôi phục và mở journal để ghi tiếp.
+        :param apply: Callable (record) applying one journal record to the state.
+        """
+        for record in records:
+            apply(record)
+            self.sequence = record["seq"]
+        self.records_since_snapshot = len(records)
+        self.file = open(self.journal_file, "a")
+
+    def append(self, record):
+        """
+        Ghi thêm một bản ghi vào journal. Phải được gọi khi đang giữ khóa trạng thái
+        để thứ tự bản ghi trùng với thứ tự áp dụng.
+        """
+        started = time.perf_counter()
+        with self.lock:
+            self.sequence += 1
+            record["seq"] = self.sequence
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            self.records_since_snapshot += 1
+            if self.records_since_snapshot >= self.snapshot_records:
+                self.snapshot_requested.set()
+        if self.metrics is not None:
+            self.metrics.observe("journal_append_seconds", time.perf_counter() - started)
+
+    def rotate(self):
+        """
+        Đóng journal hiện tại và bắt đầu một journal mới; trả về số thứ tự cuối cùng đã ghi.
+        Mọi bản ghi tới số thứ tự đó nằm trong journal cũ ({journal_file}.1).
+        """
+        with self.lock:
+            self.file.close()
+            if os.path.exists(self.rotated_file):
+                with open(self.journal_file, "rb") as source, open(self.rotated_file, "ab") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, self.rotated_file)
+            self.file = open(self.journal_file, "a")
+            self.records_since_snapshot = 0
+            return self.sequence
+
+    def write_snapshot(self, files, sequence):
+        """
+        Ghi snapshot một cách nguyên tử (tệp tạm, fsync, os.replace) rồi xóa journal cũ.
+        """
+        started = time.perf_counter()
+        temp_file = f"{self.snapshot_file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"sequence": sequence, "files": files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        os.remove(self.rotated_file)
+        if self.metrics is not None:
+            self.metrics.observe("snapshot_write_seconds", time.perf_counter() - started)
+
+    def start_compaction(self, shadow):
+        """
+        Chạy luồng nền định kỳ gộp journal vào snapshot. Luồng nền giữ một bản sao trạng thái tại
+        snapshot cuối cùng và phát lại các bản ghi của journal cũ lên đó, nên việc gộp không cần
+        khóa trạng thái của tracker và không làm nghẽn các yêu cầu.
+        :param shadow: State at the last snapshot, owned by the compaction thread, with apply(record)
+                       and to_dict().
+        """
+        def compaction_loop():
+            applied = self.snapshot_sequence
+            while True:
+                self.snapshot_requested.wait(self.snapshot_interval)
+                self.snapshot_requested.clear()
+                if not self.records_since_snapshot:
+                    continue
+                try:
+                    sequence = self.rotate()
+                    for record in self.read_records(self.rotated_file):
+                        if applied < record["seq"] <= sequence:
+                            shadow.apply(record)
+                            applied = record["seq"]
+                    self.write_snapshot(shadow.to_dict(), sequence)
+                    logging.info(f"Saved tracker snapshot at sequence {sequence}.")
+                except Exception as e:
+                    logging.error(f"Failed to save tracker snapshot: {e}")
+
+        threading.Thread(target=compaction_loop, daemon=True).start()
@@ -0,0 +1,160 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Lớp này đếm số quan sát rơi vào từng khoảng (bucket) cùng tổng và số lượng, theo kiểu histogram của Prometheus.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics:
+    """
+    Lớp này là sổ ghi các bộ đếm, histogram độ trễ và gauge của một tiến trình (tracker hoặc peer).
+    Mỗi lần ghi chỉ tốn một thao tác từ điển dưới một khóa; gauge được tính khi lấy số liệu.
+    """
+    def __init__(self, prefix):
+        """
+        Khởi tạo sổ ghi.
+        :param prefix: Prefix of every metric name in the Prometheus output (e.g. "tracker").
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Tăng một bộ đếm.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Ghi một quan sát (thường là độ trễ tính bằng giây) vào histogram.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, callback):
+        """
+        Đăng ký một gauge được tính khi lấy số liệu.
+        :param callback: Callable () -> number, or () -> {suffix: number} for several related gauges
+                         reported as name_suffix (e.g. one lock acquisition for all swarm sizes).
+        """
+        self.gauges[name] = callback
+
+    def snapshot(self):
+        """
+        Trả về toàn bộ số liệu dạng JSON: {"counters": {...}, "histograms": {...}, "gauges": {...}}.
+        Tên có nhãn được ghi dạng name{label="value"}.
+        """
+        with self.lock:
+            counters = {self.series_name(*key): value for key, value in self.counters.items()}
+            histograms = {self.series_name(*key): histogram.to_dict() for key, histogram in self.histograms.items()}
+        gauges = {"uptime_seconds": time.time() - self.started}
+        for name, callback in self.gauges.items():
+            value = callback()
+            if isinstance(value, dict):
+                for suffix, item in value.items():
+                    gauges[f"{name}_{suffix}"] = item
+            else:
+                gauges[name] = value
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    @staticmethod
+    def series_name(name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+    def prometheus(self):
+        """
+        Xuất số liệu theo định dạng văn bản của Prometheus.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        declared = set()
+
+        def declare(series, kind):
+            name = series.split("{", 1)[0]
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            return f"{self.prefix}_{series}"
+
+        for series, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{declare(series, 'counter')} {value}")
+        for series, value in sorted(snapshot["gauges"].items()):
+            if value is not None:
+                lines.append(f"{declare(series, 'gauge')} {value}")
+        for series, histogram in sorted(snapshot["histograms"].items()):
+            name, _, labels = series.partition("{")
+            labels = labels.rstrip("}")
+            full_name = declare(name, "histogram")
+            for bound, count in histogram["buckets"].items():
+                bucket_labels = ",".join(filter(None, (labels, f'le="{bound}"')))
+                lines.append(f"{full_name}_bucket{{{bucket_labels}}} {count}")
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{full_name}_sum{suffix} {histogram['sum']}")
+            lines.append(f"{full_name}_count{suffix} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from protocol import PeerConnection, TrackerClient, parse_peer_address
+
+    parser = argparse.ArgumentParser(description="Print the metrics of a tracker or peer")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--tracker", help="Tracker address ip:port")
+    target.add_argument("--peer", help="Peer address ip:port")
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json", help="Output format")
+    args = parser.parse_args()
+
+    if args.tracker:
+        client = TrackerClient(parse_peer_address(args.tracker, 0))
+        response = json.loads(client.request({"action": "stats", "format": args.format}))
+        client.close()
+        stats = response.get("text", response.get("metrics"))
+    else:
+        connection = PeerConnection(parse_peer_address(args.peer, 0), 0)
+        stats = connection.request_stats(args.format)
+        connection.close()
+    print(stats if isinstance(stats, str) else json.dumps(stats, indent=2))
@@ -1,10 +1,35 @@
-import socket
+import asyncio
 import threading
 import json
 import os
 import hashlib
 import logging
-from config import TORRENT_MAX_SIZE_KB
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    PEER_ANNOUNCE_INTERVAL, PEER_HEARTBEAT_INTERVAL, PEER_UPLOAD_SLOTS, PEER_CHOKE_INTERVAL, PEER_BUSY_RETRY,
+    PEER_UPLOAD_RATE, PEER_UPLOAD_RATE_PER_CONNECTION, PEER_DOWNLOAD_RATE, PEER_DOWNLOAD_RATE_PER_CONNECTION,
+    PEER_BACKLOG, PEER_MAX_CONNECTIONS, PEER_IDLE_TIMEOUT, PEER_WRITE_TIMEOUT, PEER_DISK_WORKERS,
+    PEER_SHUTDOWN_TIMEOUT, PEER_CACHE_SIZE_MB, PEER_CACHE_PREFETCH, PEER_DOWNLOAD_STATE_DIR,
+    DOWNLOAD_BLOCK_SIZE_KB, DOWNLOAD_BLOCK_SOURCES, DOWNLOAD_MAX_WORKERS,
+    PEER_COMPRESSION, PEER_COMPRESSION_SAMPLE_KB, PEER_COMPRESSION_MAX_RATIO, PEER_COMPRESSION_PROBES
+)
+from bandwidth import TokenBucket, UploadSlots, reserve_all
+from metrics import Metrics
+from scheduler import ChunkScheduler
+from storage import SharedFile, DownloadFile, DownloadState, ChunkCache, FileLayout
+from swarm import chunk_ranges, expand_ranges
+from torrent import Torrent, HashCache
+from protocol import (
+    PeerConnection, TrackerClient, parse_peer_address, read_message, frame_message, piece_header,
+    check_handshake, handshake_message, codec_capabilities, choose_codec, compress, compressed_piece_header,
+    encode_bitfield, decode_bitfield, pack_bitfield, unpack_bitfield,
+    REQUEST, REJECT, CANCEL, METADATA, HAVE, BUSY, STATS,
+    MSG_REQUEST, MSG_REJECT, MSG_CANCEL, MSG_METADATA_REQUEST, MSG_METADATA,
+    MSG_BITFIELD_REQUEST, MSG_BITFIELD, MSG_HAVE, MSG_BUSY, MSG_STATS_REQUEST, MSG_STATS
+)
 import tkinter as tk
 from tkinter import filedialog
 
@@ -21,166 +46,587 @@ class Peer:
         self.tracker_ip = tracker_ip
         self.tracker_port = tracker_port
         self.shared_files = {}
-        self.chunks = {}
+        self.torrents = {}
         self.downloaded_chunks = {}
         self.active_downloads = {}
+        self.connections = {}
         self.lock = threading.Lock()
+        self.connections_lock = threading.Lock()
+        self.schedulers = {}
+        self.tracker_client = TrackerClient((tracker_ip, tracker_port))
+        self.tracker_cache = {}
+        self.failed_peers = set()
+        self.received_bytes = {}
+        self.upload_limit = TokenBucket(PEER_UPLOAD_RATE)
+        self.download_limit = TokenBucket(PEER_DOWNLOAD_RATE)
+        self.upload_slots = UploadSlots(PEER_UPLOAD_SLOTS, PEER_CHOKE_INTERVAL, self.take_contributions)
+        self.disk_pool = ThreadPoolExecutor(max_workers=PEER_DISK_WORKERS)
+        self.chunk_cache = ChunkCache(PEER_CACHE_SIZE_MB * 1024 * 1024)
+        self.pending_reads = {}
+        self.compressible = OrderedDict()
+        self.connection_tasks = set()
+        self.loop = None
+        self.stop_event = None
+        self.subscribers = {}
+        self.pending_haves = {}
+        self.announce_lock = threading.Lock()
+        self.announce_thread = None
+        self.metrics = Metrics("peer")
+        self.metrics.gauge("cache", self.chunk_cache.stats)
+        self.metrics.gauge("connections", lambda: len(self.connection_tasks))
+        self.metrics.gauge("active_downloads", lambda: len(self.active_downloads))
         logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-    def register_file(self, filepath):
+    def register_files(self, filepaths):
         """
-        Đăng ký một tệp để chia sẻ với tracker.
+        Đăng ký nhiều tệp để chia sẻ với tracker trong một yêu cầu announce duy nhất.
+        Một thư mục được đăng ký như một torrent duy nhất (một swarm trên tracker).
+        :return: List of filenames accepted by the tracker.
         """
-        filename = os.path.basename(filepath)
-        file_size = os.path.getsize(filepath)
-        chunk_size = TORRENT_MAX_SIZE_KB * 1024
-        total_chunks = (file_size + chunk_size - 1) // chunk_size
-
-        os.makedirs("store", exist_ok=True)
-        with open(filepath, "rb") as f:
-            for i in range(total_chunks):
-                chunk_data = f.read(chunk_size)
-                if not chunk_data:
-                    logging.warning(f"Chunk {i} of file '{filename}' is empty. Check the source file.")
-                chunk_path = os.path.join("store", f"{filename}.torrent{i}")
-                with open(chunk_path, "wb") as chunk_file:
-                    chunk_file.write(chunk_data)
-                logging.info(f"Chunk {i} of file '{filename}' created at '{chunk_path}'.")
-
-        self.shared_files[filename] = filepath
+        entries = []
+        hash_cache = HashCache()
+        for filepath in filepaths:
+            filename = os.path.basename(os.path.normpath(filepath))
+            try:
+                metadata = Torrent.create_torrent(filepath, self.tracker_ip, self.tracker_port, hash_cache=hash_cache)
+            except Exception as e:
+                logging.error(f"Failed to create torrent for '{filepath}': {e}")
+                continue
+            shared_file = SharedFile(filepath, metadata["piece_size"], files=metadata.get("files"))
+            self.shared_files[filename] = shared_file
+            self.torrents[filename] = metadata
+            entries.append({"filename": filename, "total_chunks": shared_file.total_chunks, "complete": True})
+        hash_cache.flush()
+        if not entries:
+            return []
+
         request = {
-            "action": "register",
-            "filename": filename,
-            "total_chunks": total_chunks,
-            "peer_ip": self.ip
+            "action": "announce",
+            "files": entries,
+            "peer_ip": self.ip,
+            "peer_port": self.port
         }
         response = self.send_to_tracker(request)
         if response:
             try:
                 response_data = json.loads(response)
-                if response_data.get("status") == "success" and response_data.get("filename") == filename:
-                    logging.info(f"Registered file '{filename}' with tracker successfully.")
-                    return filename
+                if response_data.get("status") == "success":
+                    for filename, reason in response_data.get("rejected", {}).items():
+                        logging.error(f"Tracker rejected file '{filename}': {reason}")
+                    registered = response_data.get("files", [])
+                    logging.info(f"Registered {len(registered)} files with tracker successfully.")
+                    return registered
                 else:
-                    logging.error(f"Tracker responded with an error for file '{filename}': {response_data}")
+                    logging.error(f"Tracker responded with an error for announce: {response_data}")
             except json.JSONDecodeError:
-                logging.error(f"Invalid JSON response from tracker for file '{filename}': {response}")
+                logging.error(f"Invalid JSON response from tracker for announce: {response}")
         else:
-            logging.error(f"Failed to register file '{filename}' with tracker.")
-        return None
+            logging.error(f"Failed to register {len(entries)} files with tracker.")
+        return []
+
+    def register_file(self, filepath):
+        """
+        Đăng ký một tệp để chia sẻ với tracker.
+        """
+        registered = self.register_files([filepath])
+        return registered[0] if registered else None
 
     def query_tracker(self, filename):
         """
         Truy vấn thông tin về một tệp từ tracker.
         """
+        return self.conditional_query(filename, peers_only=False)
+
+    def query_peers(self, filename):
+        """
+        Hỏi tracker tập peer ban đầu của một tệp, không kèm danh sách chunk của từng peer.
+        """
+        return self.conditional_query(filename, peers_only=True)
+
+    def conditional_query(self, filename, peers_only):
+        """
+        Truy vấn tracker kèm phiên bản đã biết: tracker trả về "not_modified", chỉ phần thay đổi,
+        hoặc toàn bộ thông tin; kết quả được gộp vào bản lưu tạm của peer.
+        """
+        key = (filename, peers_only)
+        cached = self.tracker_cache.get(key)
         request = {"action": "query", "filename": filename}
+        if peers_only:
+            request["peers_only"] = True
+        if cached:
+            request["epoch"] = cached["epoch"]
+            request["if_version"] = cached["version"]
+        response = json.loads(self.send_to_tracker(request))
+
+        status = response.get("status")
+        if status == "not_modified" and cached:
+            return cached
+        if status != "success":
+            self.tracker_cache.pop(key, None)
+            return response
+
+        delta = response.pop("delta", None)
+        known_chunks = cached.get("total_chunks", len(cached.get("file_info", ()))) if cached else None
+        if delta is not None and known_chunks != response.get("total_chunks"):
+            self.tracker_cache.pop(key, None)
+            return self.conditional_query(filename, peers_only)
+        if delta is not None:
+            merged = json.loads(json.dumps(cached))
+            removed = set(delta["removed"])
+            if peers_only:
+                merged["peers"] = [peer for peer in merged["peers"] if peer not in removed]
+                merged["peers"].extend(peer for peer in delta["peers"] if peer not in merged["peers"])
+            else:
+                file_info = merged["file_info"]
+                for holders in file_info.values():
+                    holders[:] = [peer for peer in holders if peer not in removed]
+                for peer in delta["seeders"]:
+                    for holders in file_info.values():
+                        if peer not in holders:
+                            holders.append(peer)
+                for peer, ranges in delta["chunks"].items():
+                    for chunk_index in expand_ranges(ranges, len(file_info)):
+                        holders = file_info[str(chunk_index)]
+                        if peer not in holders:
+                            holders.append(peer)
+            merged["version"] = response["version"]
+            response = merged
+        self.tracker_cache[key] = response
+        return response
+
+    def list_files(self, prefix="", contains=None, after=None, limit=None):
+        """
+        Lấy một trang danh sách tệp từ tracker.
+        :return: Tracker response with "files" and the "next" page cursor.
+        """
+        request = {"action": "list_files", "prefix": prefix, "contains": contains, "after": after}
+        if limit is not None:
+            request["limit"] = limit
         response = self.send_to_tracker(request)
         return json.loads(response)
 
-    def download_file(self, filename, peer_chunks, save_path, progress_callback=None):
+    def download_file(self, filename, sources, save_path, progress_callback=None):
         """
         Tải xuống một tệp từ các peer khác.
+        :param sources: Either a list of peers (initial peer set) or a dictionary {chunk_index: [peer, ...]};
+                        the actual chunk holders are learned by exchanging bitfields with those peers.
         """
         if filename in self.active_downloads:
             logging.warning(f"Download for '{filename}' is already in progress.")
             return
 
-        def download_task():
-            total_chunks = len(peer_chunks)
-            self.downloaded_chunks[filename] = set()
-
-            def download_chunk(chunk_index, peer_ip):
-                try:
-                    conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    conn.connect((peer_ip, self.port))
-                    request = {"action": "get_chunk", "filename": filename, "chunk_index": chunk_index}
-                    conn.send(json.dumps(request).encode())
-
-                    chunk_data = b""
-                    while len(chunk_data) < TORRENT_MAX_SIZE_KB * 1024:
-                        packet = conn.recv(TORRENT_MAX_SIZE_KB * 1024 - len(chunk_data))
-                        if not packet:
-                            break
-                        chunk_data += packet
-
-                    if not chunk_data:
-                        logging.warning(f"Received empty chunk {chunk_index} from {peer_ip}.")
-                    else:
-                        logging.info(f"Received chunk {chunk_index} from {peer_ip}, size: {len(chunk_data)} bytes.")
+        if isinstance(sources, dict):
+            peer_chunks = sources
+            peers = list(dict.fromkeys(peer for holders in sources.values() for peer in holders))
+        else:
+            peer_chunks = None
+            peers = list(sources)
+        peers = [peer for peer in peers if peer != f"{self.ip}:{self.port}"]
 
-                    chunk_path = os.path.join("data", f"{filename}.torrent{chunk_index}")
-                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
-                    with open(chunk_path, "wb") as chunk_file:
-                        chunk_file.write(chunk_data)
+        def download_task():
+            try:
+                state = DownloadState.load(self.state_path(filename))
+                if state is not None and state.save_path != save_path:
+                    logging.info(f"Discarding saved progress of '{filename}': destination changed to {save_path}.")
+                    state = None
+                if state is not None and peer_chunks and len(state.metadata["pieces"]) != len(peer_chunks):
+                    state = None
+                if state is not None:
+                    metadata = state.metadata
+                else:
+                    metadata = self.fetch_metadata(filename, peers, len(peer_chunks) if peer_chunks else None)
+                    if metadata is None:
+                        logging.error(f"Could not get metadata for '{filename}' from any peer. Download aborted.")
+                        return
+
+                total_chunks = len(metadata["pieces"])
+                chunk_size = metadata["piece_size"]
+                resumed = set()
+                files = metadata.get("files")
+                if state is not None and os.path.exists(save_path):
+                    source = FileLayout(save_path, files) if files is not None else save_path
+                    resumed = Torrent.verify_pieces(source, chunk_size, metadata["pieces"], state.have)
+                    logging.info(f"Resuming '{filename}': {len(resumed)} of {total_chunks} chunks already on disk.")
+                else:
+                    state = DownloadState(self.state_path(filename), filename, save_path, metadata)
+                state.have = set(resumed)
+                state.peers = list(dict.fromkeys(state.peers + peers))
+                state.save()
+                self.downloaded_chunks[filename] = set(resumed)
+
+                def fetch_chunk(chunk_index, peer_ip, cancel_event):
+                    length = min(chunk_size, metadata["file_size"] - chunk_index * chunk_size)
+                    helpers = scheduler.helpers(chunk_index, peer_ip, DOWNLOAD_BLOCK_SOURCES - 1)
+                    started = time.perf_counter()
+                    try:
+                        chunk_data = self.fetch_blocks(filename, chunk_index, length, [peer_ip] + helpers, cancel_event)
+                    except Exception as e:
+                        if getattr(e, "retry_after", None) is not None:
+                            reason = "busy"
+                        elif cancel_event.is_set():
+                            reason = "cancelled"
+                        else:
+                            reason = "error"
+                        self.metrics.inc("chunk_fetch_failures_total", remote=peer_ip, reason=reason)
+                        raise
+                    finally:
+                        scheduler.release_helpers(helpers)
+                    self.metrics.observe("chunk_fetch_seconds", time.perf_counter() - started)
+                    logging.debug(f"Received chunk {chunk_index} from {peer_ip}, size: {len(chunk_data)} bytes.")
+                    return chunk_data
+
+                def verify_chunk(chunk_index, chunk_data):
+                    valid = hashlib.sha1(chunk_data).hexdigest() == metadata["pieces"][chunk_index]
+                    if not valid:
+                        self.metrics.inc("chunks_corrupt_total")
+                    return valid
+
+                destination = DownloadFile(save_path, metadata["file_size"], chunk_size, bool(resumed), files)
+                partial_file = SharedFile(save_path, chunk_size, set(resumed), files)
+                self.invalidate_cache(save_path)
+                with self.lock:
+                    self.shared_files[filename] = partial_file
+                    self.torrents[filename] = metadata
+
+                def save_chunk(chunk_index, chunk_data, peer_ip):
+                    destination.write_chunk(chunk_index, chunk_data)
+                    state.mark_have(chunk_index)
+                    self.broadcast_have(filename, chunk_index)
+                    self.queue_have(filename, total_chunks, chunk_index)
 
                     with self.lock:
                         self.downloaded_chunks[filename].add(chunk_index)
 
+                    self.metrics.inc("chunks_downloaded_total")
                     if progress_callback:
                         progress_callback(len(self.downloaded_chunks[filename]), total_chunks)
 
-                    logging.info(f"Downloaded chunk {chunk_index} of '{filename}' from {peer_ip} and saved to 'data' folder.")
-                    conn.close()
-                except Exception as e:
-                    logging.error(f"Failed to download chunk {chunk_index} from {peer_ip}: {e}")
-
-            threads = []
-            for chunk_index, peers in peer_chunks.items():
-                for peer_ip in peers:
-                    if chunk_index not in self.downloaded_chunks[filename]:
-                        thread = threading.Thread(target=download_chunk, args=(chunk_index, peer_ip))
-                        threads.append(thread)
-                        thread.start()
-
-            for thread in threads:
-                thread.join()
-
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, "wb") as f:
-                for i in range(total_chunks):
-                    chunk_path = os.path.join("data", f"{filename}.torrent{i}")
-                    if os.path.exists(chunk_path):
-                        with open(chunk_path, "rb") as chunk_file:
-                            f.write(chunk_file.read())
-                    else:
-                        logging.error(f"Missing chunk {i} for '{filename}'. File may be incomplete.")
-            logging.info(f"File '{filename}' downloaded and reassembled at {save_path}.")
+                    logging.debug(f"Downloaded chunk {chunk_index} of '{filename}' from {peer_ip} and wrote it to {save_path}.")
 
-            self.update_tracker(filename)
+                for chunk_index in resumed:
+                    self.queue_have(filename, total_chunks, chunk_index)
+                if progress_callback and resumed:
+                    progress_callback(len(resumed), total_chunks)
 
-            with self.lock:
-                del self.active_downloads[filename]
+                holders = {chunk_index: [] for chunk_index in range(total_chunks) if chunk_index not in resumed}
+                for chunk_index, chunk_peers in (peer_chunks or {}).items():
+                    if int(chunk_index) in holders:
+                        holders[int(chunk_index)].extend(chunk_peers)
+                scheduler = ChunkScheduler(holders, fetch_chunk, save_chunk, verify_chunk)
+                self.schedulers[filename] = scheduler
+                self.exchange_bitfields(filename, peers, scheduler)
+                try:
+                    completed = scheduler.run() | resumed
+                finally:
+                    self.schedulers.pop(filename, None)
+                    self.report_failed(scheduler.picker.excluded)
+                    destination.close(metadata["file_size"])
+
+                if len(completed) < total_chunks:
+                    missing = sorted(set(range(total_chunks)) - completed)
+                    logging.error(f"Missing chunks {missing} for '{filename}'. File may be incomplete.")
+                    state.save()
+                else:
+                    state.remove()
+                    logging.info(f"File '{filename}' downloaded to {save_path}.")
+
+                self.update_tracker(filename)
+            except Exception as e:
+                logging.error(f"Download of '{filename}' failed: {e}")
+            finally:
+                with self.lock:
+                    del self.active_downloads[filename]
 
         download_thread = threading.Thread(target=download_task)
         self.active_downloads[filename] = download_thread
         download_thread.start()
 
-    def update_tracker(self, filename):
+    def state_path(self, filename):
+        """
+        Đường dẫn tệp trạng thái lưu tiến độ tải xuống của một tệp.
+        """
+        return os.path.join(PEER_DOWNLOAD_STATE_DIR, f"{filename}.json")
+
+    def resume_downloads(self):
+        """
+        Tiếp tục các lượt tải bị gián đoạn từ các tệp trạng thái còn lại, với các peer đã biết
+        cộng các peer tracker đang báo.
+        """
+        if not os.path.isdir(PEER_DOWNLOAD_STATE_DIR):
+            return
+        for entry in sorted(os.listdir(PEER_DOWNLOAD_STATE_DIR)):
+            if not entry.endswith(".json"):
+                continue
+            state = DownloadState.load(os.path.join(PEER_DOWNLOAD_STATE_DIR, entry))
+            if state is None or state.filename in self.active_downloads or state.filename in self.shared_files:
+                continue
+            peers = list(state.peers)
+            try:
+                peers.extend(self.query_peers(state.filename).get("peers", []))
+            except (TypeError, ValueError) as e:
+                logging.warning(f"Could not query peers of '{state.filename}' from tracker: {e}")
+            logging.info(f"Resuming download of '{state.filename}' to {state.save_path}.")
+            self.download_file(state.filename, list(dict.fromkeys(peers)), state.save_path)
+
+    def fetch_blocks(self, filename, chunk_index, length, sources, cancel_event=None):
+        """
+        Tải một chunk theo từng block DOWNLOAD_BLOCK_SIZE_KB; các block được gửi liên tiếp không chờ nhau
+        và chia đều cho các nguồn. Block của nguồn phụ bị lỗi được tải lại từ nguồn chính,
+        còn lỗi của nguồn chính được trả về bộ lập lịch như trước.
+        :param sources: Peers holding the chunk, the primary source first.
+        :return: Chunk data as a bytearray.
+        """
+        block_size = DOWNLOAD_BLOCK_SIZE_KB * 1024
+        blocks = [(offset, min(block_size, length - offset)) for offset in range(0, length, block_size)]
+        sources = sources[:len(blocks)]
+        data = bytearray(length)
+        submitted = []
+        retry = []
+
+        def submit(source, connection, share):
+            for offset, size in share:
+                submitted.append((source, connection, connection.submit_block(filename, chunk_index, offset, size), offset, size))
+
+        def receive(source, connection, pending, offset, size):
+            block = connection.wait(pending, f"block {offset} of chunk {chunk_index}", cancel_event)
+            if len(block) != size:
+                raise ConnectionError(f"Received {len(block)} of {size} bytes for block {offset} of chunk {chunk_index}")
+            data[offset:offset + size] = block
+            with self.lock:
+                self.received_bytes[source] = self.received_bytes.get(source, 0) + size
+            self.metrics.inc("downloaded_bytes_total", size, remote=source)
+
+        try:
+            primary = self.get_connection(sources[0])
+            for position, source in enumerate(sources):
+                share = blocks[position * len(blocks) // len(sources):(position + 1) * len(blocks) // len(sources)]
+                if position == 0:
+                    submit(source, primary, share)
+                    continue
+                try:
+                    submit(source, self.get_connection(source), share)
+                except Exception as e:
+                    logging.debug(f"Helper {source} unavailable for chunk {chunk_index} of '{filename}': {e}")
+                    retry.extend(share)
+
+            for source, connection, pending, offset, size in list(submitted):
+                try:
+                    receive(source, connection, pending, offset, size)
+                except Exception as e:
+                    if connection is primary or (cancel_event is not None and cancel_event.is_set()):
+                        raise
+                    logging.debug(f"Helper {source} failed block {offset} of chunk {chunk_index}: {e}")
+                    retry.append((offset, size))
+
+            submitted.clear()
+            submit(sources[0], primary, retry)
+            for item in list(submitted):
+                receive(*item)
+        finally:
+            for _, connection, pending, _, _ in submitted:
+                connection.cancel(pending)
+        return data
+
+    def fetch_metadata(self, filename, peers, total_chunks=None):
+        """
+        Lấy metadata .torrent (kích thước và hash SHA-1 của từng chunk) từ một peer đang giữ tệp.
+        :param total_chunks: Chunk count reported by the tracker, if known, to reject mismatching metadata.
+        """
+        for peer in peers:
+            try:
+                metadata = self.get_connection(peer).request_metadata(filename)
+            except Exception as e:
+                logging.warning(f"Failed to get metadata for '{filename}' from {peer}: {e}")
+                continue
+            if total_chunks is not None and len(metadata.get("pieces", [])) != total_chunks:
+                logging.warning(f"Metadata for '{filename}' from {peer} does not match the tracker's chunk count.")
+                continue
+            return metadata
+        return None
+
+    def exchange_bitfields(self, filename, peers, scheduler):
+        """
+        Gửi bitfield của ta và nhận bitfield của các peer trong tập ban đầu, song song với nhau,
+        rồi nạp từng kết quả vào bộ lập lịch ngay khi nhận được. Sau đó các peer tự báo chunk mới bằng thông điệp have.
+        """
+        with self.lock:
+            bitfield = self.local_bitfield(filename)
+
+        def exchange(peer):
+            try:
+                chunk_indices = self.get_connection(peer).request_bitfield(filename, bitfield)
+            except Exception as e:
+                logging.warning(f"Failed to exchange bitfield of '{filename}' with {peer}: {e}")
+                return
+            scheduler.add_holders(peer, chunk_indices)
+
+        if not peers:
+            return
+        with ThreadPoolExecutor(max_workers=min(DOWNLOAD_MAX_WORKERS, len(peers))) as executor:
+            list(executor.map(exchange, peers))
+
+    def local_bitfield(self, filename):
+        """
+        Bitfield các chunk ta đang có của một tệp (rỗng nếu không chia sẻ). Gọi khi đang giữ self.lock.
+        """
+        shared_file = self.shared_files.get(filename)
+        if shared_file is None:
+            return b""
+        have = range(shared_file.total_chunks) if shared_file.have is None else shared_file.have
+        return encode_bitfield(have, shared_file.total_chunks)
+
+    def on_peer_have(self, peer, filename, chunk_indices):
+        """
+        Ghi nhận các chunk mà một peer vừa báo có, cập nhật lượt tải đang chạy của tệp (nếu có).
+        :param peer: Peer address, either "ip:port" or an (ip, port) tuple.
+        """
+        if isinstance(peer, tuple):
+            peer = f"{peer[0]}:{peer[1]}"
+        scheduler = self.schedulers.get(filename)
+        if scheduler is not None and chunk_indices:
+            scheduler.add_holders(peer, chunk_indices)
+
+    def broadcast_have(self, filename, chunk_index):
+        """
+        Đánh dấu một chunk đã có và báo ngay cho mọi peer đã trao đổi bitfield của tệp với ta.
+        """
+        with self.lock:
+            shared_file = self.shared_files.get(filename)
+            if shared_file is not None:
+                shared_file.mark_have(chunk_index)
+            subscribers = list(self.subscribers.get(filename, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber((MSG_HAVE, None, filename, chunk_index))
+            except RuntimeError:
+                pass
+        with self.connections_lock:
+            connections = [connection for connection in self.connections.values() if filename in connection.subscriptions]
+        for connection in connections:
+            try:
+                connection.send_have(filename, chunk_index)
+            except OSError as e:
+                logging.warning(f"Failed to send have for '{filename}' to {connection.address}: {e}")
+
+    def get_connection(self, peer):
+        """
+        Lấy kết nối lâu dài tới một peer, tạo mới nếu chưa có hoặc đã bị đóng.
+        """
+        address = parse_peer_address(peer, self.port)
+        with self.connections_lock:
+            connection = self.connections.get(address)
+        if connection and not connection.closed:
+            return connection
+
+        download_limits = (self.download_limit, TokenBucket(PEER_DOWNLOAD_RATE_PER_CONNECTION))
+        connection = PeerConnection(
+            address, self.port, on_have=self.on_peer_have, download_limits=download_limits, codecs=PEER_COMPRESSION
+        )
+        with self.connections_lock:
+            existing = self.connections.get(address)
+            if existing and not existing.closed:
+                connection.close()
+                return existing
+            self.connections[address] = connection
+        logging.debug(f"Opened connection to peer {address[0]}:{address[1]}")
+        return connection
+
+    def queue_have(self, filename, total_chunks, chunk_index):
+        """
+        Ghi nhận một chunk vừa tải xong; các chunk được gộp lại và báo cho tracker
+        trong lần announce kế tiếp (mỗi PEER_ANNOUNCE_INTERVAL giây).
+        """
+        with self.announce_lock:
+            pending = self.pending_haves.setdefault(filename, (total_chunks, set()))
+            pending[1].add(chunk_index)
+            if self.announce_thread is None:
+                self.announce_thread = threading.Thread(target=self.announce_loop, daemon=True)
+                self.announce_thread.start()
+
+    def announce_loop(self):
+        """
+        Luồng nền định kỳ gửi các chunk mới có cho tracker.
+        """
+        while True:
+            time.sleep(PEER_ANNOUNCE_INTERVAL)
+            self.update_tracker()
+
+    def update_tracker(self, filename=None):
         """
-        Cập nhật tracker với thông tin các chunk đã tải xuống.
+        Cập nhật tracker với các chunk mới tải xuống (của một tệp, hoặc mọi tệp nếu không chỉ định)
+        trong một yêu cầu announce duy nhất, dạng các dải [start, end].
         """
+        with self.announce_lock:
+            filenames = [filename] if filename is not None else list(self.pending_haves)
+            batch = {name: self.pending_haves.pop(name) for name in filenames if name in self.pending_haves}
+        if not batch:
+            return
+
         request = {
-            "action": "update",
-            "filename": filename,
-            "chunks": list(self.downloaded_chunks[filename])
+            "action": "announce",
+            "files": [
+                {"filename": name, "total_chunks": total_chunks, "chunks": chunk_ranges(chunk_indices)}
+                for name, (total_chunks, chunk_indices) in batch.items()
+            ],
+            "peer_port": self.port
         }
-        self.send_to_tracker(request)
-        logging.info(f"Updated tracker with downloaded chunks for '{filename}'.")
+        response = self.send_to_tracker(request)
+        try:
+            succeeded = response is not None and json.loads(response).get("status") == "success"
+        except json.JSONDecodeError:
+            succeeded = False
+        if not succeeded:
+            with self.announce_lock:
+                for name, (total_chunks, chunk_indices) in batch.items():
+                    self.pending_haves.setdefault(name, (total_chunks, set()))[1].update(chunk_indices)
+            logging.warning(f"Failed to announce chunks of {len(batch)} files; will retry.")
+            return
+        logging.debug(f"Updated tracker with downloaded chunks for {', '.join(repr(name) for name in batch)}.")
+
+    def take_contributions(self):
+        """
+        Trả về số byte đã nhận từ mỗi peer kể từ lần gọi trước và đặt lại bộ đếm (dùng cho choke/unchoke).
+        """
+        with self.lock:
+            received, self.received_bytes = self.received_bytes, {}
+        return received
+
+    def heartbeat_loop(self):
+        """
+        Định kỳ báo cho tracker rằng peer vẫn còn hoạt động, để tracker không loại các tệp đang chia sẻ.
+        """
+        interval = PEER_HEARTBEAT_INTERVAL
+        while True:
+            time.sleep(interval)
+            if not self.shared_files:
+                continue
+            response = self.send_to_tracker({"action": "heartbeat", "peer_port": self.port})
+            try:
+                interval = json.loads(response).get("interval", interval)
+            except (TypeError, ValueError):
+                pass
+
+    def report_failed(self, peers):
+        """
+        Ghi nhận các peer không kết nối được; danh sách được gửi kèm yêu cầu tracker kế tiếp.
+        """
+        if peers:
+            with self.lock:
+                self.failed_peers.update(peers)
 
     def send_to_tracker(self, request):
         """
-        Gửi yêu cầu đến tracker và nhận phản hồi.
+        Gửi yêu cầu đến tracker qua phiên kết nối lâu dài và nhận phản hồi.
         """
+        with self.lock:
+            if self.failed_peers:
+                request = dict(request, failed=sorted(self.failed_peers))
+                request.setdefault("peer_port", self.port)
+                self.failed_peers.clear()
         try:
-            logging.info(f"Sending request to tracker: {request}")
-            logging.info(f"{self.tracker_ip}")
-            logging.info(f"{self.tracker_port}")
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect((self.tracker_ip, self.tracker_port))
-            conn.sendall(json.dumps(request).encode())
-            response = conn.recv(1024).decode()
-            logging.info(f"Received response from tracker: {response}")
-            conn.close()
+            logging.debug(f"Sending request to tracker {self.tracker_ip}:{self.tracker_port}: {request}")
+            response = self.tracker_client.request(request).decode()
+            logging.debug(f"Received response from tracker: {response}")
             return response
         except Exception as e:
             logging.error(f"Failed to communicate with tracker: {e}")
@@ -211,80 +657,355 @@ class Peer:
 
     def start(self):
         """
-        Bắt đầu peer và lắng nghe các kết nối từ các peer khác.
+        Bắt đầu peer và lắng nghe các kết nối từ các peer khác trên một vòng lặp sự kiện asyncio.
+        Hàm chặn cho đến khi stop() được gọi.
+        """
+        threading.Thread(target=self.heartbeat_loop, daemon=True).start()
+        threading.Thread(target=self.resume_downloads, daemon=True).start()
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """
+        Chạy máy chủ peer cho đến khi có yêu cầu dừng, rồi đóng các kết nối một cách êm:
+        các phản hồi đã xếp hàng được gửi nốt trong thời hạn PEER_SHUTDOWN_TIMEOUT.
         """
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind((self.ip, self.port))
-        server.listen(5)
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        server = await asyncio.start_server(
+            self.handle_peer_connection, self.ip, self.port, backlog=PEER_BACKLOG, reuse_address=True
+        )
         logging.info(f"Peer running on {self.ip}:{self.port}")
+        await self.stop_event.wait()
+        # Close the connections before waiting for the server: since Python 3.12 wait_closed()
+        # also waits for every open connection, so it would block on persistent peer connections.
+        server.close()
+        for task in list(self.connection_tasks):
+            task.cancel()
+        if self.connection_tasks:
+            await asyncio.wait(list(self.connection_tasks), timeout=PEER_SHUTDOWN_TIMEOUT)
+        try:
+            await asyncio.wait_for(server.wait_closed(), PEER_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Peer on {self.ip}:{self.port} stopped with connections still closing.")
+        self.disk_pool.shutdown(wait=False)
+        logging.info(f"Peer on {self.ip}:{self.port} stopped.")
 
-        while True:
-            conn, addr = server.accept()
-            logging.info(f"Connection from {addr}")
-            threading.Thread(target=self.handle_peer_request, args=(conn,)).start()
+    def stop(self):
+        """
+        Dừng máy chủ peer: ngừng nhận kết nối mới và đóng các kết nối đang mở.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
 
-    def handle_peer_request(self, conn):
+    async def handle_peer_connection(self, reader, writer):
         """
-        Xử lý yêu cầu từ các peer khác.
+        Xử lý kết nối từ một peer khác: handshake rồi nhận liên tiếp các yêu cầu chunk,
+        bitfield và thông điệp have. Phản hồi được gửi theo thứ tự bởi serve_requests.
         """
-        try:
-            data = conn.recv(1024).decode()
-            request = json.loads(data)
-            action = request.get("action")
+        addr = writer.get_extra_info("peername")
+        if len(self.connection_tasks) >= PEER_MAX_CONNECTIONS:
+            logging.warning(f"Rejecting connection from {addr}: {len(self.connection_tasks)} connections open")
+            writer.close()
+            return
 
-            if action == "get_chunk":
-                self.upload_chunk(conn, request)
-            else:
-                logging.warning(f"Unknown action '{action}' from peer.")
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        logging.debug(f"Connection from {addr}")
+        queue = asyncio.Queue()
+        queued = set()
+        cancelled = set()
+        last_requested = {}
+        subscriptions = []
+        remote_peer = None
+        sender = None
+        upload_limit = TokenBucket(PEER_UPLOAD_RATE_PER_CONNECTION)
+        loop = self.loop
+
+        def subscriber(item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        try:
+            handshake = await asyncio.wait_for(read_message(reader), PEER_IDLE_TIMEOUT)
+            listen_port, remote_capabilities = check_handshake(*handshake)
+            writer.write(handshake_message(self.port, codec_capabilities(PEER_COMPRESSION)))
+            remote_peer = f"{addr[0]}:{listen_port}"
+            codec = choose_codec(PEER_COMPRESSION, remote_capabilities)
+            sender = asyncio.create_task(
+                self.serve_requests(writer, queue, queued, cancelled, upload_limit, last_requested, codec, remote_peer)
+            )
+
+            while True:
+                msg_type, payload = await asyncio.wait_for(read_message(reader), PEER_IDLE_TIMEOUT)
+                if msg_type == MSG_REQUEST:
+                    request_id, chunk_index, block_offset, block_length = REQUEST.unpack_from(payload)
+                    filename = payload[REQUEST.size:].decode()
+                    retry_after = self.upload_slots.allow(remote_peer)
+                    if retry_after:
+                        self.metrics.inc("busy_replies_total")
+                        queue.put_nowait((MSG_BUSY, request_id, filename, max(retry_after, PEER_BUSY_RETRY)))
+                    else:
+                        queued.add(request_id)
+                        queue.put_nowait((msg_type, request_id, filename, (chunk_index, block_offset, block_length)))
+                elif msg_type == MSG_METADATA_REQUEST:
+                    request_id, = METADATA.unpack_from(payload)
+                    filename = payload[METADATA.size:].decode()
+                    queue.put_nowait((msg_type, request_id, filename, None))
+                elif msg_type == MSG_BITFIELD_REQUEST:
+                    request_id, filename, bitfield = unpack_bitfield(payload)
+                    self.on_peer_have(remote_peer, filename, decode_bitfield(bitfield))
+                    with self.lock:
+                        local_bitfield = self.local_bitfield(filename)
+                        self.subscribers.setdefault(filename, []).append(subscriber)
+                    subscriptions.append(filename)
+                    queue.put_nowait((MSG_BITFIELD, request_id, filename, local_bitfield))
+                elif msg_type == MSG_HAVE:
+                    chunk_index, = HAVE.unpack_from(payload)
+                    self.on_peer_have(remote_peer, payload[HAVE.size:].decode(), [chunk_index])
+                elif msg_type == MSG_CANCEL:
+                    request_id, = CANCEL.unpack_from(payload)
+                    if request_id in queued:
+                        cancelled.add(request_id)
+                elif msg_type == MSG_STATS_REQUEST:
+                    request_id, = STATS.unpack_from(payload)
+                    queue.put_nowait((MSG_STATS, request_id, None, bytes(payload[STATS.size:]).decode()))
+                else:
+                    logging.warning(f"Unknown message type {msg_type} from peer.")
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except asyncio.TimeoutError:
+            logging.info(f"Connection from {addr} idle for {PEER_IDLE_TIMEOUT}s, closing.")
         except Exception as e:
             logging.error(f"Error handling peer request: {e}")
         finally:
-            conn.close()
-
-    def load_chunks(self):
+            if remote_peer is not None:
+                self.upload_slots.release(remote_peer)
+            with self.lock:
+                for filename in subscriptions:
+                    self.subscribers[filename].remove(subscriber)
+            if sender is not None:
+                queue.put_nowait(None)
+                try:
+                    await asyncio.wait_for(sender, PEER_WRITE_TIMEOUT)
+                except Exception:
+                    pass
+            writer.close()
+            self.connection_tasks.discard(task)
+
+    async def serve_requests(self, writer, queue, queued, cancelled, upload_limit=None, last_requested=None, codec=0,
+                             remote_peer=None):
         """
-        Tải các chunk của tệp được chia sẻ từ thư mục lưu trữ.
+        Lần lượt gửi các chunk, metadata, bitfield, have và số liệu cho peer trên một kết nối.
+        :param queued: Request ids waiting in the queue; a CANCEL only applies to these.
+        :param cancelled: Request ids cancelled by the peer, skipped when dequeued.
+        :param upload_limit: Token bucket limiting this connection's upload rate.
+        :param last_requested: Last chunk requested per file on this connection, for read-ahead.
+        :param codec: Compression codec negotiated with the peer, 0 if none.
+        :param remote_peer: Listening address of the peer, used to count uploaded bytes per peer.
         """
-        for filename in self.shared_files:
-            file_path = self.shared_files[filename]
-            file_size = os.path.getsize(file_path)
-            chunk_size = TORRENT_MAX_SIZE_KB * 1024
-            total_chunks = (file_size + chunk_size - 1) // chunk_size
-
-            self.chunks[filename] = {}
-            for i in range(total_chunks):
-                chunk_path = os.path.join("store", f"{filename}.torrent{i}")
-                if os.path.exists(chunk_path):
-                    try:
-                        with open(chunk_path, "rb") as chunk_file:
-                            self.chunks[filename][i] = chunk_file.read()
-                        logging.info(f"Loaded chunk {i} of '{filename}' from '{chunk_path}'.")
-                    except Exception as e:
-                        logging.error(f"Failed to read chunk {i} of '{filename}' from '{chunk_path}': {e}")
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            msg_type, request_id, filename, argument = item
+            if msg_type == MSG_REQUEST:
+                queued.discard(request_id)
+                if request_id in cancelled:
+                    cancelled.discard(request_id)
+                    continue
+            try:
+                if msg_type == MSG_METADATA_REQUEST:
+                    self.upload_metadata(writer, request_id, filename)
+                elif msg_type == MSG_BITFIELD:
+                    writer.write(frame_message(MSG_BITFIELD, pack_bitfield(request_id, filename, argument)))
+                elif msg_type == MSG_HAVE:
+                    writer.write(frame_message(MSG_HAVE, HAVE.pack(argument) + filename.encode()))
+                elif msg_type == MSG_BUSY:
+                    writer.write(frame_message(MSG_BUSY, BUSY.pack(request_id, argument)))
+                elif msg_type == MSG_STATS:
+                    writer.write(frame_message(MSG_STATS, STATS.pack(request_id) + self.stats(argument).encode()))
                 else:
-                    logging.warning(f"Chunk {i} of '{filename}' is missing in 'store' folder.")
+                    await self.upload_chunk(
+                        writer, request_id, filename, *argument, upload_limit, last_requested, codec, remote_peer
+                    )
+                await asyncio.wait_for(writer.drain(), PEER_WRITE_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                logging.error(f"Failed to send to peer for '{filename}': {e!r}")
+                writer.transport.abort()
+                return
+
+    def stats(self, format="json"):
+        """
+        Số liệu của peer: chuỗi JSON, hoặc văn bản Prometheus khi `format` là "prometheus".
+        """
+        if format == "prometheus":
+            return self.metrics.prometheus()
+        return json.dumps(self.metrics.snapshot())
+
+    def upload_metadata(self, writer, request_id, filename):
+        """
+        Gửi metadata .torrent của một tệp đang chia sẻ cho peer yêu cầu.
+        """
+        metadata = self.torrents.get(filename)
+        if metadata is None:
+            writer.write(frame_message(MSG_REJECT, REJECT.pack(request_id) + b"Metadata not found"))
+            return
+        writer.write(frame_message(MSG_METADATA, METADATA.pack(request_id) + json.dumps(metadata).encode()))
 
-    def upload_chunk(self, conn, request):
+    async def upload_chunk(self, writer, request_id, filename, chunk_index, block_offset=0, block_length=0,
+                           upload_limit=None, last_requested=None, codec=0, remote_peer=None):
         """
-        Tải lên một chunk của tệp được yêu cầu bởi peer khác.
+        Tải lên một block của chunk được yêu cầu bởi peer khác, sau khi chờ đủ token của giới hạn tốc độ
+        chung và của kết nối cho số byte thực sự gửi đi (sau khi nén). Chunk được lấy từ cache bộ nhớ, hoặc đọc từ tệp gốc trên nhóm luồng đĩa
+        rồi đưa vào cache; chunk quá lớn so với cache chỉ được đọc đúng block được yêu cầu. Khi không dùng
+        cache, block của một tệp đơn được gửi thẳng từ tệp bằng sendfile.
+        :param block_offset: Offset of the block within the chunk.
+        :param block_length: Length of the block; 0 means the rest of the chunk.
+        :param last_requested: Dictionary {filename: last chunk index} of this connection, used to detect
+                               sequential requests and read the following chunks ahead.
+        :param codec: Compression codec negotiated with the peer; the block is sent compressed when it helps.
+        :param remote_peer: Listening address of the peer, used to count uploaded bytes per peer.
         """
-        filename = request["filename"]
-        chunk_index = request["chunk_index"]
+        shared_file = self.shared_files.get(filename)
+        chunk_range = shared_file.chunk_range(chunk_index) if shared_file else None
+        if chunk_range is None:
+            logging.error(f"Chunk {chunk_index} of '{filename}' is not shared by this peer.")
+            writer.write(frame_message(MSG_REJECT, REJECT.pack(request_id) + b"Chunk not found"))
+            return
 
-        chunk_path = os.path.join("store", f"{filename}.torrent{chunk_index}")
-        if os.path.exists(chunk_path):
+        offset, chunk_length = chunk_range
+        length = block_length or chunk_length - block_offset
+        if length <= 0 or block_offset + length > chunk_length:
+            logging.error(f"Invalid block {block_offset}+{block_length} of chunk {chunk_index} of '{filename}'.")
+            writer.write(frame_message(MSG_REJECT, REJECT.pack(request_id) + b"Invalid block"))
+            return
+        if last_requested is not None and block_offset == 0:
+            if last_requested.get(filename) == chunk_index - 1:
+                self.prefetch(shared_file, chunk_index + 1)
+            last_requested[filename] = chunk_index
+
+        if codec and self.compressible.get((shared_file.path, chunk_index)) is False:
+            codec = 0
+        cached = self.chunk_cache.fits(chunk_length)
+        if cached or shared_file.layout is not None or codec:
             try:
-                with open(chunk_path, "rb") as chunk_file:
-                    chunk_data = chunk_file.read()
-                conn.send(chunk_data)
-                logging.info(f"Uploaded chunk {chunk_index} of '{filename}' from '{chunk_path}', size: {len(chunk_data)} bytes.")
-            except Exception as e:
-                logging.error(f"Failed to read or send chunk {chunk_index} of '{filename}' from '{chunk_path}': {e}")
-                conn.send(b"")
+                if cached:
+                    data = self.chunk_cache.get((shared_file.path, chunk_index))
+                    if data is None:
+                        data = await self.load_chunk(shared_file, chunk_index)
+                    block = memoryview(data)[block_offset:block_offset + length]
+                else:
+                    data = block = await self.loop.run_in_executor(
+                        self.disk_pool, shared_file.read_chunk, chunk_index, block_offset, length
+                    )
+            except (OSError, IndexError) as e:
+                logging.error(f"Failed to read chunk {chunk_index} of '{filename}' from '{shared_file.path}': {e}")
+                writer.write(frame_message(MSG_REJECT, REJECT.pack(request_id) + b"Chunk unreadable"))
+                return
+            compressed = await self.compressed_block(shared_file, chunk_index, block_offset, data, block, codec)
+            payload_length = len(compressed) if compressed is not None else length
+            await self.wait_upload_tokens(upload_limit, payload_length)
+            if compressed is not None:
+                writer.write(compressed_piece_header(request_id, chunk_index, block_offset, codec, len(compressed)))
+                writer.write(compressed)
+                self.metrics.inc("compressed_bytes_saved_total", length - len(compressed))
+            else:
+                writer.write(piece_header(request_id, chunk_index, block_offset, length))
+                writer.write(block)
         else:
-            logging.error(f"Chunk {chunk_index} of '{filename}' not found in 'store' folder.")
-            conn.send(b"")
+            payload_length = length
+            await self.wait_upload_tokens(upload_limit, payload_length)
+            try:
+                chunk_file = await self.loop.run_in_executor(self.disk_pool, open, shared_file.path, "rb")
+            except OSError as e:
+                logging.error(f"Failed to open '{shared_file.path}' for chunk {chunk_index} of '{filename}': {e}")
+                writer.write(frame_message(MSG_REJECT, REJECT.pack(request_id) + b"Chunk unreadable"))
+                return
+            with chunk_file:
+                writer.write(piece_header(request_id, chunk_index, block_offset, length))
+                sent = await asyncio.wait_for(
+                    self.loop.sendfile(writer.transport, chunk_file, offset + block_offset, length), PEER_WRITE_TIMEOUT
+                )
+            if sent != length:
+                raise ConnectionError(f"Sent {sent} of {length} bytes for chunk {chunk_index}; source file changed")
+        self.metrics.inc("uploaded_bytes_total", payload_length, remote=remote_peer)
+        logging.debug(f"Uploaded block {block_offset} of chunk {chunk_index} of '{filename}', size: {payload_length} bytes.")
+
+    async def wait_upload_tokens(self, upload_limit, amount):
+        """
+        Chờ đủ token của giới hạn tốc độ tải lên chung và của kết nối cho `amount` byte thực sự gửi đi.
+        """
+        delay = reserve_all((self.upload_limit, upload_limit), amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def compressed_block(self, shared_file, chunk_index, block_offset, data, block, codec):
+        """
+        Trả về bản nén của một block (lấy từ cache nếu đã nén trước đó), hoặc None nếu không nên nén.
+        Mỗi chunk được nén thử một mẫu nhỏ một lần; chunk có tỉ lệ nén kém (dữ liệu đã nén, ngẫu nhiên)
+        được gửi nguyên, và block chỉ được gửi nén khi nhỏ hơn bản gốc đủ nhiều.
+        :param data: Whole chunk (or the block when the chunk is not cached), used for the compressibility probe.
+        """
+        if not codec:
+            return None
+        probe_key = (shared_file.path, chunk_index)
+        compressible = self.compressible.get(probe_key)
+        if compressible is None:
+            sample = bytes(data[:PEER_COMPRESSION_SAMPLE_KB * 1024])
+            compressible = len(zlib.compress(sample, 1)) <= len(sample) * PEER_COMPRESSION_MAX_RATIO
+            self.compressible[probe_key] = compressible
+            if len(self.compressible) > PEER_COMPRESSION_PROBES:
+                self.compressible.popitem(last=False)
+        if not compressible:
+            return None
+        key = (shared_file.path, chunk_index, block_offset, len(block), codec)
+        compressed = self.chunk_cache.get(key)
+        if compressed is not None:
+            return compressed
+        compressed = await self.loop.run_in_executor(self.disk_pool, compress, codec, bytes(block))
+        if len(compressed) > len(block) * PEER_COMPRESSION_MAX_RATIO:
+            return None
+        self.chunk_cache.put(key, compressed)
+        return compressed
+
+    def invalidate_cache(self, path):
+        """
+        Bỏ các chunk trong cache và kết quả thử nén của một tệp (khi tệp được ghi lại).
+        """
+        self.chunk_cache.invalidate(path)
+        for key in [key for key in list(self.compressible) if key[0] == path]:
+            self.compressible.pop(key, None)
+
+    def load_chunk(self, shared_file, chunk_index):
+        """
+        Đọc một chunk vào cache trên nhóm luồng đĩa. Các yêu cầu đồng thời cho cùng một chunk
+        dùng chung một lần đọc. Chỉ gọi trên luồng của vòng lặp sự kiện.
+        :return: Future resolving to the chunk data.
+        """
+        key = (shared_file.path, chunk_index)
+        future = self.pending_reads.get(key)
+        if future is None:
+            future = self.loop.run_in_executor(self.disk_pool, shared_file.read_chunk, chunk_index)
+            self.pending_reads[key] = future
+
+            def store(done):
+                self.pending_reads.pop(key, None)
+                if not done.cancelled() and done.exception() is None:
+                    self.chunk_cache.put(key, done.result())
+
+            future.add_done_callback(store)
+        return future
+
+    def prefetch(self, shared_file, chunk_index):
+        """
+        Đọc trước vào cache PEER_CACHE_PREFETCH chunk bắt đầu từ `chunk_index` khi peer đang tải tuần tự.
+        """
+        for index in range(chunk_index, chunk_index + PEER_CACHE_PREFETCH):
+            chunk_range = shared_file.chunk_range(index)
+            if chunk_range is None or not self.chunk_cache.fits(chunk_range[1]):
+                break
+            key = (shared_file.path, index)
+            if key not in self.pending_reads and not self.chunk_cache.contains(key):
+                self.load_chunk(shared_file, index)
 
 if __name__ == "__main__":
     import argparse
@@ -293,7 +1014,9 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, required=True, help="Peer port")
     parser.add_argument("--tracker-ip", required=True, help="Tracker IP address")
     parser.add_argument("--tracker-port", type=int, required=True, help="Tracker port")
+    parser.add_argument("--log-level", default="info", help="Log level (debug logs every chunk and connection)")
     args = parser.parse_args()
 
     peer = Peer(ip=args.ip, port=args.port, tracker_ip=args.tracker_ip, tracker_port=args.tracker_port)
+    logging.getLogger().setLevel(args.log_level.upper())
     threading.Thread(target=peer.start).start()
\ No newline at end of file
@@ -0,0 +1,680 @@
+import socket
+import struct
+import zlib
+import lzma
+import threading
+import itertools
+import json
+import logging
+import random
+import time
+from bandwidth import throttle
+from config import (
+    PEER_CONNECT_TIMEOUT, PEER_REQUEST_TIMEOUT,
+    TRACKER_CLIENT_TIMEOUT, TRACKER_CLIENT_RETRIES, TRACKER_CLIENT_BACKOFF, TRACKER_CLIENT_MAX_BACKOFF
+)
+
+MAGIC = b"MMTP"
+PROTOCOL_VERSION = 4
+
+# Every message is framed as: payload length (u32), message type (u8), payload.
+HEADER = struct.Struct(">IB")
+# Handshake: magic, protocol version, listening port and capability bits.
+HANDSHAKE = struct.Struct(">4sBHB")
+# Block request: request id, chunk index, offset in the chunk and length (0 = rest of the chunk).
+REQUEST = struct.Struct(">IIII")
+PIECE = struct.Struct(">III")
+# Compressed piece: request id, chunk index, offset in the chunk and codec id.
+COMPRESSED_PIECE = struct.Struct(">IIIB")
+REJECT = struct.Struct(">I")
+CANCEL = struct.Struct(">I")
+METADATA = struct.Struct(">I")
+# Bitfield request/reply: request id and filename length, then filename and bitfield (MSB first).
+BITFIELD = struct.Struct(">IH")
+HAVE = struct.Struct(">I")
+# Busy reply: request id and seconds after which the request may be retried.
+BUSY = struct.Struct(">If")
+# Stats request/reply: request id, then the format ("json" or "prometheus") or the stats text.
+STATS = struct.Struct(">I")
+# Tracker requests and replies are framed as: payload length (u32), request id (u32), JSON payload.
+TRACKER_FRAME = struct.Struct(">II")
+
+MSG_HANDSHAKE = 0
+MSG_REQUEST = 1
+MSG_PIECE = 2
+MSG_REJECT = 3
+MSG_CANCEL = 4
+MSG_METADATA_REQUEST = 5
+MSG_METADATA = 6
+MSG_BITFIELD_REQUEST = 7
+MSG_BITFIELD = 8
+MSG_HAVE = 9
+MSG_BUSY = 10
+MSG_PIECE_COMPRESSED = 11
+MSG_STATS_REQUEST = 12
+MSG_STATS = 13
+
+# Capability bits announced in the handshake. A compression capability bit is also
+# the codec id carried by MSG_PIECE_COMPRESSED.
+CAP_ZLIB = 1
+CAP_LZMA = 2
+CODECS = {"zlib": CAP_ZLIB, "lzma": CAP_LZMA}
+
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """
+    Lỗi khi peer gửi thông điệp không đúng giao thức.
+    """
+
+
+class PeerBusyError(ConnectionError):
+    """
+    Peer bên kia đang hết slot tải lên; yêu cầu có thể được gửi lại sau `retry_after` giây.
+    """
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_peer_address(peer, default_port):
+    """
+    Tách địa chỉ peer dạng "ip:port" (hoặc chỉ "ip") thành (ip, port).
+    """
+    host, separator, port = str(peer).rpartition(":")
+    if separator and port.isdigit():
+        return host, int(port)
+    return str(peer), default_port
+
+
+def encode_bitfield(chunk_indices, total_chunks):
+    """
+    Mã hóa tập chỉ số chunk thành bitfield (bit cao nhất của byte đầu là chunk 0).
+    """
+    bitfield = bytearray((total_chunks + 7) // 8)
+    for chunk_index in chunk_indices:
+        bitfield[chunk_index >> 3] |= 0x80 >> (chunk_index & 7)
+    return bytes(bitfield)
+
+
+def decode_bitfield(bitfield):
+    """
+    Trả về danh sách chỉ số chunk có bit được bật trong bitfield.
+    """
+    return [
+        (position << 3) + bit
+        for position, byte in enumerate(bitfield) if byte
+        for bit in range(8) if byte & (0x80 >> bit)
+    ]
+
+
+def pack_bitfield(request_id, filename, bitfield):
+    name = filename.encode()
+    return BITFIELD.pack(request_id, len(name)) + name + bitfield
+
+
+def unpack_bitfield(payload):
+    """
+    Tách thông điệp bitfield thành (request id, filename, bitfield).
+    """
+    request_id, name_length = BITFIELD.unpack_from(payload)
+    end = BITFIELD.size + name_length
+    return request_id, bytes(payload[BITFIELD.size:end]).decode(), bytes(payload[end:])
+
+
+def recv_exact(conn, size):
+    """
+    Nhận đúng `size` byte từ socket vào một bộ đệm cấp phát sẵn.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if not count:
+            raise ConnectionError("Connection closed by remote peer")
+        received += count
+    return buffer
+
+
+def send_message(conn, msg_type, payload=b""):
+    """
+    Gửi một thông điệp đã đóng khung qua socket.
+    """
+    conn.sendall(HEADER.pack(len(payload), msg_type) + payload)
+
+
+def frame_message(msg_type, payload=b""):
+    """
+    Đóng khung một thông điệp để ghi qua asyncio StreamWriter.
+    """
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+def piece_header(request_id, chunk_index, offset, length):
+    """
+    Phần đầu của thông điệp PIECE cho một block của chunk; dữ liệu được gửi ngay sau đó.
+    """
+    return HEADER.pack(PIECE.size + length, MSG_PIECE) + PIECE.pack(request_id, chunk_index, offset)
+
+
+async def read_message(reader):
+    """
+    Đọc một thông điệp đã đóng khung từ asyncio StreamReader.
+    :return: (message type, payload as bytes).
+    """
+    length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message of {length} bytes exceeds the limit")
+    return msg_type, await reader.readexactly(length)
+
+
+def check_handshake(msg_type, payload):
+    """
+    Kiểm tra handshake của peer bên kia.
+    :return: (the remote peer's listening port, its capability bits).
+    """
+    if msg_type != MSG_HANDSHAKE or len(payload) != HANDSHAKE.size:
+        raise ProtocolError("Expected handshake")
+    magic, version, listen_port, capabilities = HANDSHAKE.unpack(payload)
+    if magic != MAGIC or version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol {magic!r} v{version}")
+    return listen_port, capabilities
+
+
+def codec_capabilities(codecs):
+    """
+    Các bit capability tương ứng với danh sách tên codec nén (bỏ qua tên không hỗ trợ).
+    """
+    capabilities = 0
+    for name in codecs:
+        capabilities |= CODECS.get(name, 0)
+    return capabilities
+
+
+def choose_codec(codecs, remote_capabilities):
+    """
+    Chọn codec nén đầu tiên trong danh sách ưu tiên mà peer bên kia cũng hỗ trợ.
+    :return: Codec id, or 0 if compression is not used on the connection.
+    """
+    for name in codecs:
+        codec = CODECS.get(name, 0)
+        if codec & remote_capabilities:
+            return codec
+    return 0
+
+
+def compress(codec, data):
+    if codec == CAP_ZLIB:
+        return zlib.compress(data, 6)
+    if codec == CAP_LZMA:
+        return lzma.compress(data, preset=1)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress(codec, data, max_length=MAX_MESSAGE_SIZE):
+    """
+    Giải nén dữ liệu một block, từ chối dữ liệu bị cắt cụt hoặc giải nén ra quá `max_length` byte.
+    """
+    if codec == CAP_ZLIB:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_length + 1)
+        if decompressor.unconsumed_tail or not decompressor.eof or len(result) > max_length:
+            raise ProtocolError("Invalid or oversized zlib block")
+        return result
+    if codec == CAP_LZMA:
+        decompressor = lzma.LZMADecompressor()
+        result = decompressor.decompress(data, max_length + 1)
+        if not decompressor.eof or len(result) > max_length:
+            raise ProtocolError("Invalid or oversized lzma block")
+        return result
+    raise ProtocolError(f"Unknown codec {codec}")
+
+
+def compressed_piece_header(request_id, chunk_index, offset, codec, length):
+    """
+    Phần đầu của thông điệp PIECE_COMPRESSED; `length` là độ dài dữ liệu đã nén gửi ngay sau đó.
+    """
+    return (HEADER.pack(COMPRESSED_PIECE.size + length, MSG_PIECE_COMPRESSED)
+            + COMPRESSED_PIECE.pack(request_id, chunk_index, offset, codec))
+
+
+def recv_message(conn):
+    """
+    Nhận một thông điệp đã đóng khung.
+    :return: (message type, payload as bytearray).
+    """
+    length, msg_type = HEADER.unpack(recv_exact(conn, HEADER.size))
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message of {length} bytes exceeds the limit")
+    return msg_type, recv_exact(conn, length)
+
+
+def encode_tracker_frame(request_id, message):
+    """
+    Đóng khung một yêu cầu hoặc phản hồi JSON của tracker; `message` có thể là bytes đã tuần tự hóa sẵn.
+    """
+    payload = message if isinstance(message, bytes) else json.dumps(message).encode()
+    return TRACKER_FRAME.pack(len(payload), request_id) + payload
+
+
+def recv_tracker_frame(conn):
+    """
+    Nhận trọn một khung của tracker, bất kể kích thước.
+    :return: (request id, payload as bytearray).
+    """
+    length, request_id = TRACKER_FRAME.unpack(recv_exact(conn, TRACKER_FRAME.size))
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Tracker frame of {length} bytes exceeds the limit")
+    return request_id, recv_exact(conn, length)
+
+
+def handshake_message(listen_port, capabilities=0):
+    return frame_message(MSG_HANDSHAKE, HANDSHAKE.pack(MAGIC, PROTOCOL_VERSION, listen_port, capabilities))
+
+
+def send_handshake(conn, listen_port, capabilities=0):
+    conn.sendall(handshake_message(listen_port, capabilities))
+
+
+def recv_handshake(conn):
+    """
+    Nhận và kiểm tra handshake của peer bên kia.
+    :return: (the remote peer's listening port, its capability bits).
+    """
+    return check_handshake(*recv_message(conn))
+
+
+class CancelEvent(threading.Event):
+    """
+    Sự kiện hủy một lượt tải: ngoài cờ như threading.Event, set() còn gọi ngay các callback đã đăng ký,
+    để những yêu cầu đang chờ được đánh thức mà không phải kiểm tra cờ định kỳ.
+    """
+    def __init__(self):
+        super().__init__()
+        self.callbacks_lock = threading.Lock()
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        """
+        Đăng ký một callback gọi khi sự kiện được bật; gọi ngay nếu đã bật.
+        """
+        with self.callbacks_lock:
+            if not self.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self.callbacks_lock:
+            super().set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class PendingRequest:
+    """
+    Một yêu cầu chunk đang chờ phản hồi trên kết nối.
+    :param max_length: Largest piece accepted for the request, bounding decompression.
+    """
+    def __init__(self, request_id=None, max_length=MAX_MESSAGE_SIZE):
+        self.request_id = request_id
+        self.max_length = max_length
+        self.done = threading.Event()
+        self.aborted = False
+        self.data = None
+        self.error = None
+
+    def abort(self):
+        """
+        Đánh thức luồng đang chờ yêu cầu vì lượt tải đã bị hủy.
+        """
+        self.aborted = True
+        self.done.set()
+
+
+class PeerConnection:
+    """
+    Lớp này giữ một kết nối lâu dài tới một peer và cho phép gửi nhiều yêu cầu chunk cùng lúc.
+    """
+    def __init__(self, address, listen_port, timeout=PEER_CONNECT_TIMEOUT, on_have=None, download_limits=(),
+                 codecs=()):
+        """
+        Kết nối tới peer và thực hiện handshake.
+        :param address: (ip, port) of the remote peer.
+        :param listen_port: Our own listening port, announced in the handshake.
+        :param on_have: Callable (address, filename, chunk_indices) called when the peer announces new chunks.
+        :param download_limits: Token buckets throttling how fast pieces are read from this connection.
+        :param codecs: Compression codecs we accept for pieces ("zlib", "lzma").
+        """
+        self.address = address
+        self.on_have = on_have
+        self.download_limits = download_limits
+        self.subscriptions = set()
+        self.conn = socket.create_connection(address, timeout=timeout)
+        try:
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_handshake(self.conn, listen_port, codec_capabilities(codecs))
+            _, self.remote_capabilities = recv_handshake(self.conn)
+            self.conn.settimeout(None)
+        except Exception:
+            self.conn.close()
+            raise
+
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.closed = False
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _send(self, msg_type, payload):
+        with self.send_lock:
+            send_message(self.conn, msg_type, payload)
+
+    def request_chunk(self, filename, chunk_index, cancel_event=None, timeout=PEER_REQUEST_TIMEOUT):
+        """
+        Gửi yêu cầu toàn bộ một chunk và chờ dữ liệu trả về.
+        Nhiều luồng có thể gọi đồng thời; các yêu cầu được gửi liên tiếp trên cùng kết nối.
+        """
+        return self.wait(self.submit_block(filename, chunk_index), f"chunk {chunk_index}", cancel_event, timeout)
+
+    def submit_block(self, filename, chunk_index, offset=0, length=0):
+        """
+        Gửi yêu cầu một block của chunk mà không chờ, để nhiều block được gửi liên tiếp (pipelining).
+        :param length: Block length in bytes; 0 requests the rest of the chunk.
+        :return: Pending request to pass to wait() or cancel().
+        """
+        return self._submit(
+            MSG_REQUEST, lambda request_id: REQUEST.pack(request_id, chunk_index, offset, length) + filename.encode(),
+            length or MAX_MESSAGE_SIZE
+        )
+
+    def request_metadata(self, filename, timeout=PEER_REQUEST_TIMEOUT):
+        """
+        Yêu cầu metadata .torrent của một tệp từ peer.
+        :return: Metadata dictionary.
+        """
+        payload = self._request(
+            MSG_METADATA_REQUEST, lambda request_id: METADATA.pack(request_id) + filename.encode(),
+            f"metadata of '{filename}'", None, timeout
+        )
+        return json.loads(bytes(payload))
+
+    def request_bitfield(self, filename, bitfield, timeout=PEER_REQUEST_TIMEOUT):
+        """
+        Trao đổi bitfield của một tệp với peer và đăng ký nhận các thông điệp have tiếp theo.
+        :param bitfield: Our own bitfield for the file, so the peer learns what we can serve.
+        :return: List of chunk indices the peer holds.
+        """
+        payload = self._request(
+            MSG_BITFIELD_REQUEST, lambda request_id: pack_bitfield(request_id, filename, bitfield),
+            f"bitfield of '{filename}'", None, timeout
+        )
+        self.subscriptions.add(filename)
+        return decode_bitfield(payload)
+
+    def request_stats(self, format="json", timeout=PEER_REQUEST_TIMEOUT):
+        """
+        Lấy số liệu (metrics) của peer.
+        :param format: "json" for a dictionary, "prometheus" for the Prometheus text format.
+        :return: Metrics dictionary, or the Prometheus text.
+        """
+        payload = self._request(
+            MSG_STATS_REQUEST, lambda request_id: STATS.pack(request_id) + format.encode(), "stats", None, timeout
+        )
+        text = bytes(payload).decode()
+        return text if format == "prometheus" else json.loads(text)
+
+    def send_have(self, filename, chunk_index):
+        """
+        Báo cho peer rằng ta vừa có thêm một chunk.
+        """
+        self._send(MSG_HAVE, HAVE.pack(chunk_index) + filename.encode())
+
+    def _request(self, msg_type, build_payload, description, cancel_event, timeout):
+        return self.wait(self._submit(msg_type, build_payload), description, cancel_event, timeout)
+
+    def _submit(self, msg_type, build_payload, max_length=MAX_MESSAGE_SIZE):
+        if self.closed:
+            raise ConnectionError(f"Connection to {self.address} is closed")
+        pending = PendingRequest(next(self.request_ids), max_length)
+        with self.pending_lock:
+            self.pending[pending.request_id] = pending
+        try:
+            self._send(msg_type, build_payload(pending.request_id))
+        except Exception:
+            with self.pending_lock:
+                self.pending.pop(pending.request_id, None)
+            raise
+        return pending
+
+    def wait(self, pending, description, cancel_event=None, timeout=PEER_REQUEST_TIMEOUT):
+        """
+        Chờ phản hồi của một yêu cầu đã gửi; yêu cầu bị hủy ngay khi `cancel_event` được bật.
+        :param cancel_event: CancelEvent whose set() wakes this wait at once.
+        :return: Response payload.
+        """
+        if cancel_event is not None:
+            cancel_event.add_callback(pending.abort)
+        try:
+            if not pending.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for {description} from {self.address}")
+            if pending.aborted:
+                self.cancel(pending)
+                raise ConnectionAbortedError(f"Request for {description} cancelled")
+        finally:
+            with self.pending_lock:
+                self.pending.pop(pending.request_id, None)
+
+        if pending.error:
+            raise pending.error
+        return pending.data
+
+    def cancel(self, pending):
+        """
+        Hủy một yêu cầu chưa có phản hồi; peer bỏ qua yêu cầu nếu chưa gửi dữ liệu.
+        """
+        with self.pending_lock:
+            self.pending.pop(pending.request_id, None)
+        if (pending.done.is_set() and not pending.aborted) or self.closed:
+            return
+        try:
+            self._send(MSG_CANCEL, CANCEL.pack(pending.request_id))
+        except OSError:
+            pass
+
+    def _resolve(self, request_id, data=None, error=None):
+        with self.pending_lock:
+            pending = self.pending.get(request_id)
+        if pending:
+            pending.data = data
+            pending.error = error
+            pending.done.set()
+
+    def _reader(self):
+        try:
+            while True:
+                msg_type, payload = recv_message(self.conn)
+                if msg_type == MSG_PIECE:
+                    request_id, _, _ = PIECE.unpack_from(payload)
+                    self._resolve(request_id, data=memoryview(payload)[PIECE.size:])
+                    throttle(self.download_limits, len(payload))
+                elif msg_type == MSG_PIECE_COMPRESSED:
+                    request_id, _, _, codec = COMPRESSED_PIECE.unpack_from(payload)
+                    with self.pending_lock:
+                        pending = self.pending.get(request_id)
+                    if pending is not None:
+                        try:
+                            data = decompress(codec, memoryview(payload)[COMPRESSED_PIECE.size:], pending.max_length)
+                        except (zlib.error, lzma.LZMAError, ProtocolError) as e:
+                            self._resolve(request_id, error=ProtocolError(f"Bad compressed piece from {self.address}: {e}"))
+                        else:
+                            self._resolve(request_id, data=data)
+                    throttle(self.download_limits, len(payload))
+                elif msg_type == MSG_METADATA:
+                    request_id, = METADATA.unpack_from(payload)
+                    self._resolve(request_id, data=memoryview(payload)[METADATA.size:])
+                elif msg_type == MSG_BITFIELD:
+                    request_id, _, bitfield = unpack_bitfield(payload)
+                    self._resolve(request_id, data=bitfield)
+                elif msg_type == MSG_STATS:
+                    request_id, = STATS.unpack_from(payload)
+                    self._resolve(request_id, data=memoryview(payload)[STATS.size:])
+                elif msg_type == MSG_HAVE:
+                    chunk_index, = HAVE.unpack_from(payload)
+                    if self.on_have:
+                        self.on_have(self.address, payload[HAVE.size:].decode(), [chunk_index])
+                elif msg_type == MSG_BUSY:
+                    request_id, retry_after = BUSY.unpack_from(payload)
+                    self._resolve(request_id, error=PeerBusyError(f"Peer {self.address} is busy", retry_after))
+                elif msg_type == MSG_REJECT:
+                    request_id, = REJECT.unpack_from(payload)
+                    reason = payload[REJECT.size:].decode(errors="replace")
+                    self._resolve(request_id, error=FileNotFoundError(reason))
+                else:
+                    logging.warning(f"Unexpected message type {msg_type} from {self.address}")
+        except Exception as e:
+            if not self.closed:
+                logging.debug(f"Connection to {self.address} lost: {e}")
+            self.close()
+            with self.pending_lock:
+                pending_requests = list(self.pending.values())
+            for pending in pending_requests:
+                pending.error = ConnectionError(f"Connection to {self.address} lost")
+                pending.done.set()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class TrackerClient:
+    """
+    Lớp này giữ một kết nối lâu dài tới tracker. Nhiều yêu cầu có thể chờ cùng lúc trên một kết nối,
+    phản hồi được ghép theo request id. Khi mất kết nối, client kết nối lại với thời gian chờ
+    tăng theo cấp số nhân (kèm ngẫu nhiên) để không dồn dập vào tracker đang khởi động lại.
+    """
+    def __init__(self, address, timeout=TRACKER_CLIENT_TIMEOUT, retries=TRACKER_CLIENT_RETRIES,
+                 backoff=TRACKER_CLIENT_BACKOFF, max_backoff=TRACKER_CLIENT_MAX_BACKOFF):
+        """
+        Khởi tạo client; kết nối được mở khi có yêu cầu đầu tiên.
+        :param address: (ip, port) of the tracker.
+        :param retries: Attempts per request before giving up.
+        :param backoff: Initial reconnect delay in seconds, doubled after each failure up to max_backoff.
+        """
+        self.address = address
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.conn = None
+        self.connect_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    def request(self, message, timeout=None):
+        """
+        Gửi một yêu cầu tới tracker và chờ phản hồi, thử lại khi mất kết nối.
+        :return: Response payload as bytes.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        error = None
+        for _ in range(self.retries):
+            try:
+                return self._request_once(message, timeout)
+            except (OSError, ProtocolError) as e:
+                error = e
+        raise ConnectionError(f"Tracker {self.address[0]}:{self.address[1]} unavailable: {error}")
+
+    def _request_once(self, message, timeout):
+        conn = self._connection(timeout)
+        request_id = next(self.request_ids)
+        pending = PendingRequest()
+        with self.pending_lock:
+            self.pending[request_id] = pending
+        try:
+            with self.send_lock:
+                conn.sendall(encode_tracker_frame(request_id, message))
+            if not pending.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for tracker reply {request_id}")
+        finally:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+        if pending.error:
+            raise pending.error
+        return bytes(pending.data)
+
+    def _connection(self, timeout):
+        """
+        Trả về kết nối hiện tại hoặc mở kết nối mới, tôn trọng thời gian chờ backoff.
+        """
+        with self.connect_lock:
+            if self.conn is not None:
+                return self.conn
+            delay = self.next_attempt - time.monotonic()
+            if delay > timeout:
+                raise ConnectionError(f"Tracker reconnect backed off for {delay:.1f}s")
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                conn = socket.create_connection(self.address, timeout=timeout)
+            except OSError:
+                self._backoff()
+                raise
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.settimeout(None)
+            self.conn = conn
+            self.failures = 0
+            threading.Thread(target=self._reader, args=(conn,), daemon=True).start()
+            return conn
+
+    def _backoff(self):
+        delay = min(self.max_backoff, self.backoff * (2 ** self.failures))
+        self.failures += 1
+        self.next_attempt = time.monotonic() + delay * random.uniform(0.5, 1.0)
+
+    def _reader(self, conn):
+        try:
+            while True:
+                request_id, payload = recv_tracker_frame(conn)
+                with self.pending_lock:
+                    pending = self.pending.get(request_id)
+                if pending:
+                    pending.data = payload
+                    pending.done.set()
+        except Exception as e:
+            logging.debug(f"Tracker connection lost: {e}")
+        with self.connect_lock:
+            if self.conn is conn:
+                self.conn = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+        with self.pending_lock:
+            pending_requests = list(self.pending.values())
+        for pending in pending_requests:
+            if not pending.done.is_set():
+                pending.error = ConnectionError("Tracker connection lost")
+                pending.done.set()
+
+    def close(self):
+        with self.connect_lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
@@ -0,0 +1,400 @@
+import threading
+import logging
+import random
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from protocol import CancelEvent
+from config import (
+    DOWNLOAD_MAX_WORKERS, DOWNLOAD_MAX_PER_PEER, DOWNLOAD_PEER_MAX_FAILURES,
+    DOWNLOAD_ENDGAME_CHUNKS, DOWNLOAD_ENDGAME_MAX_SOURCES,
+    DOWNLOAD_VERIFY_WORKERS, DOWNLOAD_CORRUPT_PENALTY
+)
+
+
+class PiecePicker:
+    """
+    Lớp này chọn chunk tiếp theo cần tải theo chiến lược hiếm nhất trước (rarest-first).
+    """
+    def __init__(self, holders):
+        """
+        Khởi tạo bộ chọn chunk.
+        :param holders: Dictionary {chunk_index: [peer, ...]}.
+        """
+        self.holders = holders
+        self.excluded = set()
+        self.rarity = {}
+        self.order = {}
+        self.pending = list(holders)
+        self.sort_pending()
+
+    def sort_pending(self):
+        """
+        Sắp xếp các chunk đang chờ theo số peer đang giữ, ngẫu nhiên khi bằng nhau.
+        """
+        self.rarity = {
+            index: sum(1 for peer in peers if peer not in self.excluded)
+            for index, peers in self.holders.items()
+        }
+        self.order = {index: random.random() for index in self.holders}
+        self.pending.sort(key=self.sort_key)
+
+    def sort_key(self, chunk_index):
+        return self.rarity[chunk_index], self.order[chunk_index]
+
+    def exclude_peer(self, peer):
+        """
+        Loại bỏ một peer khỏi mọi danh sách nguồn và cập nhật lại độ hiếm.
+        """
+        if peer not in self.excluded:
+            self.excluded.add(peer)
+            self.sort_pending()
+
+    def requeue(self, chunk_index):
+        """
+        Đưa một chunk trở lại hàng đợi theo đúng vị trí độ hiếm của nó.
+        """
+        self.pending.insert(bisect_left(self.pending, self.sort_key(chunk_index), key=self.sort_key), chunk_index)
+
+    def add_holder(self, chunk_index, peer):
+        """
+        Cập nhật độ hiếm của một chunk vừa có thêm `peer` làm nguồn (đã nằm trong holders)
+        và chỉ dời chunk đó trong hàng đợi, thay vì sắp xếp lại toàn bộ.
+        """
+        if peer in self.excluded:
+            return
+        position = bisect_left(self.pending, self.sort_key(chunk_index), key=self.sort_key)
+        queued = position < len(self.pending) and self.pending[position] == chunk_index
+        self.rarity[chunk_index] += 1
+        if queued:
+            del self.pending[position]
+            self.requeue(chunk_index)
+
+    def candidates(self, chunk_index, skip):
+        return [peer for peer in self.holders[chunk_index] if peer not in self.excluded and peer not in skip]
+
+    def pick(self, tried_peers, has_slot):
+        """
+        Chọn chunk hiếm nhất có ít nhất một peer còn slot trống.
+        :param tried_peers: Dictionary {chunk_index: set(peer)} of peers that already failed.
+        :param has_slot: Callable (peer) -> bool.
+        :return: (chunk_index, [peer, ...]) or None, and the list of chunks with no source left.
+        """
+        unavailable = []
+        for position, chunk_index in enumerate(self.pending):
+            candidates = self.candidates(chunk_index, tried_peers[chunk_index])
+            if not candidates:
+                unavailable.append(chunk_index)
+                continue
+            available = [peer for peer in candidates if has_slot(peer)]
+            if available:
+                del self.pending[position]
+                return (chunk_index, available), unavailable
+        return None, unavailable
+
+
+class ChunkScheduler:
+    """
+    Lớp này điều phối việc tải các chunk bằng một nhóm luồng có giới hạn.
+    Mỗi chunk chỉ được tải từ một peer tại một thời điểm và được chuyển sang peer khác khi lỗi;
+    riêng các chunk cuối cùng (endgame) được tải song song từ nhiều peer và bản chậm hơn bị hủy.
+    Việc kiểm tra hash và ghi chunk chạy trên một nhóm luồng riêng, tách khỏi các luồng mạng.
+    """
+    def __init__(self, peer_chunks, fetch_chunk, on_chunk=None, verify_chunk=None,
+                 max_workers=DOWNLOAD_MAX_WORKERS, max_per_peer=DOWNLOAD_MAX_PER_PEER,
+                 max_peer_failures=DOWNLOAD_PEER_MAX_FAILURES,
+                 endgame_chunks=DOWNLOAD_ENDGAME_CHUNKS, endgame_max_sources=DOWNLOAD_ENDGAME_MAX_SOURCES,
+                 verify_workers=DOWNLOAD_VERIFY_WORKERS, corrupt_penalty=DOWNLOAD_CORRUPT_PENALTY):
+        """
+        Khởi tạo bộ lập lịch.
+        :param peer_chunks: Dictionary {chunk_index: [peer, ...]}; may grow later through add_holders.
+        :param fetch_chunk: Callable (chunk_index, peer, cancel_event) -> bytes, raises on failure;
+                            cancel_event is a CancelEvent set when another peer delivered the chunk first;
+                            an exception with a `retry_after` attribute marks the peer busy, not failed.
+        :param on_chunk: Callable (chunk_index, data, peer) called once per verified chunk.
+        :param verify_chunk: Callable (chunk_index, data) -> bool checking the chunk's hash.
+        :param max_workers: Maximum number of concurrent fetches.
+        :param max_per_peer: Maximum number of concurrent fetches against one peer.
+        :param max_peer_failures: Failures after which a peer is no longer used.
+        :param endgame_chunks: Outstanding chunk count at which endgame mode starts.
+        :param endgame_max_sources: Maximum number of peers fetching the same chunk in endgame.
+        :param verify_workers: Number of threads verifying and storing chunks.
+        :param corrupt_penalty: Failures charged to a peer that sent a corrupt chunk.
+        """
+        self.holders = {int(index): list(peers) for index, peers in peer_chunks.items()}
+        self.fetch_chunk = fetch_chunk
+        self.on_chunk = on_chunk
+        self.verify_chunk = verify_chunk
+        self.max_workers = max(1, max_workers)
+        self.max_per_peer = max(1, max_per_peer)
+        self.max_peer_failures = max_peer_failures
+        self.endgame_chunks = endgame_chunks
+        self.endgame_max_sources = max(1, endgame_max_sources)
+        self.verify_workers = max(1, verify_workers)
+        self.corrupt_penalty = corrupt_penalty
+
+        self.picker = PiecePicker(self.holders)
+        self.tried_peers = {index: set() for index in self.holders}
+        self.in_flight = {}
+        self.verifying = set()
+        self.peer_load = {}
+        self.peer_failures = {}
+        self.helped = set()
+        self.suspect = set()
+        self.busy_until = {}
+        self.completed = set()
+        self.failed = set()
+        self.condition = threading.Condition()
+        self.executor = None
+
+    def run(self):
+        """
+        Tải tất cả các chunk và chờ đến khi hoàn tất.
+        :return: Set of chunk indices that were downloaded successfully.
+        """
+        worker_count = min(self.max_workers, len(self.holders))
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(worker_count)]
+        self.executor = ThreadPoolExecutor(max_workers=self.verify_workers)
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            self.executor.shutdown(wait=True)
+
+        if self.failed:
+            logging.error(f"Could not download chunks {sorted(self.failed)}: no working peer left.")
+        return self.completed
+
+    def add_holders(self, peer, chunk_indices):
+        """
+        Ghi nhận các chunk mà một peer vừa báo có (qua bitfield hoặc have), kể cả khi đang tải.
+        Chunk trước đó không còn nguồn nào sẽ được đưa lại vào hàng đợi.
+        """
+        with self.condition:
+            added = False
+            for chunk_index in chunk_indices:
+                peers = self.holders.get(chunk_index)
+                if peers is None or peer in peers:
+                    continue
+                peers.append(peer)
+                added = True
+                self.picker.add_holder(chunk_index, peer)
+                if chunk_index in self.failed:
+                    self.failed.discard(chunk_index)
+                    self.picker.requeue(chunk_index)
+            if added:
+                self.condition.notify_all()
+
+    def helpers(self, chunk_index, peer, limit):
+        """
+        Chọn tối đa `limit` peer khác có thể cùng tải các block của một chunk mà `peer` đang tải:
+        peer phải giữ chunk, chưa lỗi với chunk này và còn slot trống; peer ít tải nhất được ưu tiên.
+        Mỗi peer được chọn chiếm một slot cho đến khi release_helpers được gọi. Chunk từng sai hash
+        khi tải từ nhiều nguồn chỉ được tải lại từ một nguồn, để biết chắc peer nào gửi dữ liệu hỏng.
+        """
+        if limit <= 0:
+            return []
+        with self.condition:
+            if chunk_index in self.suspect:
+                return []
+            skip = self.tried_peers.get(chunk_index, set()) | {peer}
+            available = [other for other in self.picker.candidates(chunk_index, skip) if self._has_slot(other)]
+            available.sort(key=lambda other: self.peer_load.get(other, 0))
+            chosen = available[:limit]
+            for other in chosen:
+                self.peer_load[other] = self.peer_load.get(other, 0) + 1
+            if chosen:
+                self.helped.add((chunk_index, peer))
+        return chosen
+
+    def release_helpers(self, peers):
+        """
+        Trả lại các slot đã giữ bởi helpers().
+        """
+        if not peers:
+            return
+        with self.condition:
+            for peer in peers:
+                self.peer_load[peer] -= 1
+            self.condition.notify_all()
+
+    def _has_slot(self, peer):
+        if self.busy_until.get(peer, 0) > time.monotonic():
+            return False
+        return self.peer_load.get(peer, 0) < self.max_per_peer
+
+    def _busy_wait(self):
+        """
+        Số giây đến khi peer bận sớm nhất được thử lại, hoặc None nếu không có peer nào đang bận.
+        """
+        now = time.monotonic()
+        waits = [until - now for until in self.busy_until.values() if until > now]
+        return min(waits) if waits else None
+
+    def _least_loaded(self, peers):
+        return min(peers, key=lambda peer: self.peer_load.get(peer, 0))
+
+    def _pick_endgame(self):
+        """
+        Chọn một chunk đang tải để yêu cầu thêm từ một peer khác khi đã vào endgame.
+        """
+        outstanding = [index for index in self.in_flight if index not in self.completed]
+        if self.picker.pending or len(outstanding) > self.endgame_chunks:
+            return None
+        for chunk_index in sorted(outstanding, key=lambda index: len(self.in_flight[index])):
+            sources = self.in_flight[chunk_index]
+            if len(sources) >= self.endgame_max_sources:
+                continue
+            skip = self.tried_peers[chunk_index] | set(sources)
+            available = [peer for peer in self.picker.candidates(chunk_index, skip) if self._has_slot(peer)]
+            if available:
+                return chunk_index, available
+        return None
+
+    def _next_assignment(self):
+        with self.condition:
+            while True:
+                if not self.picker.pending and not self.in_flight and not self.verifying:
+                    return None
+                choice, unavailable = self.picker.pick(self.tried_peers, self._has_slot)
+                for chunk_index in unavailable:
+                    self.picker.pending.remove(chunk_index)
+                    self.failed.add(chunk_index)
+                if choice is None:
+                    choice = self._pick_endgame()
+                    if choice:
+                        logging.debug(f"Endgame: requesting chunk {choice[0]} from an additional peer.")
+                if choice:
+                    chunk_index, available = choice
+                    peer = self._least_loaded(available)
+                    cancel_event = CancelEvent()
+                    self.in_flight.setdefault(chunk_index, {})[peer] = cancel_event
+                    self.peer_load[peer] = self.peer_load.get(peer, 0) + 1
+                    return chunk_index, peer, cancel_event
+                busy_wait = self._busy_wait()
+                if not self.in_flight and not self.verifying and busy_wait is None:
+                    if self.picker.pending:
+                        continue
+                    return None
+                self.condition.wait(busy_wait)
+
+    def _release(self, chunk_index, peer):
+        sources = self.in_flight[chunk_index]
+        del sources[peer]
+        if not sources:
+            del self.in_flight[chunk_index]
+        self.peer_load[peer] -= 1
+
+    def _penalize(self, peer, amount):
+        self.peer_failures[peer] = self.peer_failures.get(peer, 0) + amount
+        if amount and self.peer_failures[peer] >= self.max_peer_failures:
+            logging.warning(f"Peer {peer} failed {self.peer_failures[peer]} times, no longer using it.")
+            self.picker.exclude_peer(peer)
+
+    def _requeue_if_idle(self, chunk_index):
+        if chunk_index not in self.completed and chunk_index not in self.in_flight:
+            self.picker.requeue(chunk_index)
+
+    def _claim(self, chunk_index, peer):
+        """
+        Nhận dữ liệu của chunk để kiểm tra; trả về False nếu một peer khác đã về trước.
+        """
+        with self.condition:
+            self._release(chunk_index, peer)
+            if chunk_index in self.completed:
+                self.condition.notify_all()
+                return False
+            self.completed.add(chunk_index)
+            self.verifying.add(chunk_index)
+            for cancel_event in self.in_flight.get(chunk_index, {}).values():
+                cancel_event.set()
+            self.condition.notify_all()
+            return True
+
+    def _fail(self, chunk_index, peer, cancelled=False):
+        with self.condition:
+            self._release(chunk_index, peer)
+            if not cancelled:
+                self.tried_peers[chunk_index].add(peer)
+                self._penalize(peer, 1)
+            self._requeue_if_idle(chunk_index)
+            self.condition.notify_all()
+
+    def _busy(self, chunk_index, peer, retry_after):
+        """
+        Peer hết slot tải lên: đưa chunk lại hàng đợi và tạm ngừng dùng peer, không tính là lỗi.
+        """
+        with self.condition:
+            self._release(chunk_index, peer)
+            self.busy_until[peer] = time.monotonic() + max(0.0, retry_after)
+            self._requeue_if_idle(chunk_index)
+            self.condition.notify_all()
+
+    def _reject(self, chunk_index, peer, penalty, helped=False):
+        """
+        Bỏ dữ liệu của một chunk và đưa chunk lại hàng đợi. Nếu chunk được ghép từ block của nhiều peer
+        thì không thể biết peer nào sai: không phạt ai, chunk được tải lại từ một nguồn duy nhất.
+        """
+        with self.condition:
+            self.verifying.discard(chunk_index)
+            self.completed.discard(chunk_index)
+            if helped and penalty:
+                self.suspect.add(chunk_index)
+            else:
+                self.tried_peers[chunk_index].add(peer)
+                self._penalize(peer, penalty)
+            self._requeue_if_idle(chunk_index)
+            self.condition.notify_all()
+
+    def _complete(self, chunk_index, data, peer, helped=False):
+        """
+        Kiểm tra hash và lưu một chunk trên luồng riêng, không chặn các luồng mạng.
+        :param helped: The chunk was assembled from blocks of several peers.
+        """
+        try:
+            if self.verify_chunk and not self.verify_chunk(chunk_index, data):
+                logging.warning(f"Chunk {chunk_index} from {peer} failed hash verification, re-queueing.")
+                self._reject(chunk_index, peer, self.corrupt_penalty, helped)
+                return
+            if self.on_chunk:
+                self.on_chunk(chunk_index, data, peer)
+        except Exception as e:
+            logging.error(f"Failed to store chunk {chunk_index} from {peer}: {e}")
+            self._reject(chunk_index, peer, 0)
+            return
+
+        with self.condition:
+            self.verifying.discard(chunk_index)
+            self.peer_failures[peer] = 0
+            self.condition.notify_all()
+
+    def _worker(self):
+        while True:
+            assignment = self._next_assignment()
+            if assignment is None:
+                return
+            chunk_index, peer, cancel_event = assignment
+            try:
+                data = self.fetch_chunk(chunk_index, peer, cancel_event)
+            except Exception as e:
+                with self.condition:
+                    self.helped.discard((chunk_index, peer))
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None and not cancel_event.is_set():
+                    logging.debug(f"Peer {peer} is busy, retrying chunk {chunk_index} in {retry_after:.1f}s.")
+                    self._busy(chunk_index, peer, retry_after)
+                    continue
+                if cancel_event.is_set():
+                    logging.debug(f"Cancelled slower request for chunk {chunk_index} from {peer}.")
+                else:
+                    logging.warning(f"Chunk {chunk_index} failed from {peer}, re-queueing: {e}")
+                self._fail(chunk_index, peer, cancel_event.is_set())
+                continue
+
+            with self.condition:
+                helped = (chunk_index, peer) in self.helped
+                self.helped.discard((chunk_index, peer))
+            if self._claim(chunk_index, peer):
+                self.executor.submit(self._complete, chunk_index, data, peer, helped)
@@ -0,0 +1,448 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from config import PEER_DOWNLOAD_STATE_INTERVAL, PEER_CACHE_MIN_CHUNKS
+from protocol import encode_bitfield, decode_bitfield
+
+
+class FileLayout:
+    """
+    Lớp này ánh xạ dòng byte liên tục của một torrent thư mục tới các tệp thật bên trong thư mục,
+    theo bảng tệp [{"path": relative path, "size": bytes, "offset": offset in the stream}, ...].
+    """
+    def __init__(self, root, files):
+        """
+        Khởi tạo bố cục; đường dẫn không được thoát ra ngoài thư mục gốc.
+        :param root: Directory holding the files.
+        :param files: File table from the torrent metadata.
+        """
+        self.root = root
+        self.files = files
+        self.size = sum(entry["size"] for entry in files)
+        self.segments = []
+        offset = 0
+        for entry in files:
+            parts = entry["path"].split("/")
+            if entry["path"].startswith("/") or any(part in ("", ".", "..") for part in parts):
+                raise ValueError(f"Unsafe path '{entry['path']}' in file table")
+            if entry["offset"] != offset or entry["size"] < 0:
+                raise ValueError(f"Inconsistent offset or size for '{entry['path']}' in file table")
+            offset += entry["size"]
+            if entry["size"]:
+                self.segments.append((entry["offset"], os.path.join(root, *parts), entry["size"]))
+        self.offsets = [offset for offset, _, _ in self.segments]
+
+    @staticmethod
+    def scan(directory):
+        """
+        Lập bảng tệp cho mọi tệp thường trong một thư mục, sắp xếp theo đường dẫn tương đối.
+        """
+        paths = []
+        for current, directories, filenames in os.walk(directory):
+            directories.sort()
+            for filename in filenames:
+                path = os.path.join(current, filename)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    paths.append(os.path.relpath(path, directory).replace(os.sep, "/"))
+        files = []
+        offset = 0
+        for relative_path in sorted(paths):
+            size = os.path.getsize(os.path.join(directory, relative_path))
+            files.append({"path": relative_path, "size": size, "offset": offset})
+            offset += size
+        return files
+
+    def paths(self):
+        return [os.path.join(self.root, *entry["path"].split("/")) for entry in self.files]
+
+    def locate(self, offset, length):
+        """
+        Chia đoạn [offset, offset + length) của dòng byte thành các đoạn (path, offset in file, length).
+        """
+        position = max(0, bisect_right(self.offsets, offset) - 1)
+        while length > 0 and position < len(self.segments):
+            start, path, size = self.segments[position]
+            count = min(length, start + size - offset)
+            if count > 0:
+                yield path, offset - start, count
+                offset += count
+                length -= count
+            position += 1
+
+    def read(self, offset, length):
+        """
+        Đọc một đoạn của dòng byte, có thể trải qua nhiều tệp.
+        """
+        parts = []
+        for path, file_offset, count in self.locate(offset, length):
+            with open(path, "rb") as f:
+                f.seek(file_offset)
+                parts.append(f.read(count))
+        return b"".join(parts)
+
+    def open(self):
+        """
+        Mở dòng byte để đọc tuần tự (dùng khi băm toàn bộ torrent).
+        """
+        return LayoutReader(self)
+
+
+class LayoutReader:
+    """
+    Đối tượng giống tệp đọc tuần tự các tệp của một FileLayout nối tiếp nhau.
+    """
+    def __init__(self, layout):
+        self.paths = [path for _, path, _ in layout.segments]
+        self.file = None
+
+    def read(self, size):
+        parts = []
+        while size > 0:
+            if self.file is None:
+                if not self.paths:
+                    break
+                self.file = open(self.paths.pop(0), "rb")
+            data = self.file.read(size)
+            if not data:
+                self.file.close()
+                self.file = None
+                continue
+            parts.append(data)
+            size -= len(data)
+        return b"".join(parts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            self.file.close()
+
+
+class SharedFile:
+    """
+    Lớp này mô tả một tệp (hoặc một thư mục nhiều tệp) được chia sẻ trực tiếp từ đường dẫn gốc, không sao chép chunk.
+    """
+    def __init__(self, path, piece_size, have=None, files=None):
+        """
+        Khởi tạo thông tin tệp chia sẻ.
+        :param path: Path to the original file (or directory) on disk.
+        :param piece_size: Size of each chunk in bytes.
+        :param have: Set of chunk indices available for a file still being downloaded; None if complete.
+        :param files: File table of a directory torrent; None for a single file.
+        """
+        self.path = path
+        self.layout = FileLayout(path, files) if files is not None else None
+        self.size = self.layout.size if self.layout else os.path.getsize(path)
+        self.piece_size = piece_size
+        self.total_chunks = (self.size + piece_size - 1) // piece_size
+        self.have = have if have is None or len(have) < self.total_chunks else None
+
+    def mark_have(self, chunk_index):
+        """
+        Đánh dấu một chunk đã được ghi xong và có thể phục vụ cho peer khác.
+        """
+        if self.have is not None:
+            self.have.add(chunk_index)
+            if len(self.have) == self.total_chunks:
+                self.have = None
+
+    def chunk_range(self, chunk_index):
+        """
+        Trả về (offset, length) của một chunk trong tệp gốc, hoặc None nếu chỉ số không hợp lệ.
+        """
+        if not 0 <= chunk_index < self.total_chunks:
+            return None
+        have = self.have
+        if have is not None and chunk_index not in have:
+            return None
+        offset = chunk_index * self.piece_size
+        return offset, min(self.piece_size, self.size - offset)
+
+    def read_chunk(self, chunk_index, block_offset=0, block_length=None):
+        """
+        Đọc nội dung một chunk (hoặc một block trong chunk) từ tệp gốc.
+        :param block_offset: Offset of the block within the chunk.
+        :param block_length: Length of the block; None reads the rest of the chunk.
+        """
+        chunk_range = self.chunk_range(chunk_index)
+        if chunk_range is None:
+            raise IndexError(f"Chunk {chunk_index} out of range for '{self.path}'")
+        offset, length = chunk_range
+        offset += block_offset
+        length = length - block_offset if block_length is None else min(block_length, length - block_offset)
+        if self.layout is not None:
+            return self.layout.read(offset, length)
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+def open_preallocated(path, size, resume=False):
+    """
+    Mở (tạo nếu chưa có) một tệp đích và cấp phát trước `size` byte.
+    :param resume: Keep the existing content instead of truncating the file.
+    :return: File descriptor.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0) | (0 if resume else os.O_TRUNC)
+    fd = os.open(path, flags, 0o644)
+    os.ftruncate(fd, size)
+    if hasattr(os, "posix_fallocate") and size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+    return fd
+
+
+def write_at(fd, data, offset, lock):
+    """
+    Ghi toàn bộ `data` vào vị trí `offset` của một tệp đang mở.
+    """
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+    else:
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = 0
+            while written < len(view):
+                written += os.write(fd, view[written:])
+
+
+class DownloadFile:
+    """
+    Lớp này đại diện cho tệp đích của một lượt tải: được cấp phát trước
+    và mỗi chunk được ghi thẳng vào đúng vị trí khi vừa nhận xong.
+    Với torrent thư mục, đích là một thư mục và mỗi chunk được ghi vào các tệp mà nó trải qua.
+    """
+    def __init__(self, path, size, piece_size, resume=False, files=None):
+        """
+        Tạo (hoặc ghi đè) tệp đích và cấp phát trước dung lượng.
+        :param path: Destination path (a directory for a directory torrent).
+        :param size: Number of bytes to preallocate.
+        :param piece_size: Size of each chunk in bytes.
+        :param resume: Keep the existing content so an interrupted download can continue.
+        :param files: File table of a directory torrent; None for a single file.
+        """
+        self.path = path
+        self.piece_size = piece_size
+        self.end = 0
+        self.lock = threading.Lock()
+        self.layout = FileLayout(path, files) if files is not None else None
+        if self.layout is None:
+            self.fd = open_preallocated(path, size, resume)
+            return
+        self.fd = None
+        os.makedirs(path, exist_ok=True)
+        for entry, file_path in zip(files, self.layout.paths()):
+            os.close(open_preallocated(file_path, entry["size"], resume))
+
+    def write_chunk(self, chunk_index, data):
+        """
+        Ghi một chunk vào đúng vị trí của nó trong tệp đích.
+        """
+        offset = chunk_index * self.piece_size
+        if self.layout is not None:
+            view = memoryview(data)
+            position = 0
+            for path, file_offset, count in self.layout.locate(offset, len(view)):
+                fd = os.open(path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+                try:
+                    write_at(fd, view[position:position + count], file_offset, self.lock)
+                finally:
+                    os.close(fd)
+                position += count
+            return
+        write_at(self.fd, data, offset, self.lock)
+        with self.lock:
+            self.end = max(self.end, offset + len(data))
+
+    def close(self, size=None):
+        """
+        Cắt tệp về đúng kích thước thật rồi đóng lại.
+        :param size: Final file size; defaults to the end of the furthest chunk written.
+        """
+        if self.fd is None:
+            return
+        os.ftruncate(self.fd, self.end if size is None else size)
+        os.close(self.fd)
+
+
+class DownloadState:
+    """
+    Lớp này lưu tiến độ của một lượt tải xuống (metadata, tệp đích, bitfield các chunk đã ghi và các peer đã biết)
+    vào một tệp trạng thái, để lượt tải được tiếp tục sau khi tiến trình bị dừng đột ngột.
+    Tệp được ghi nguyên tử và tối đa mỗi `interval` giây; các chunk ghi sau lần lưu cuối chỉ phải tải lại.
+    """
+    def __init__(self, path, filename, save_path, metadata, have=(), peers=(), interval=PEER_DOWNLOAD_STATE_INTERVAL):
+        """
+        Khởi tạo trạng thái.
+        :param path: Path of the state file.
+        :param filename: Name of the file being downloaded.
+        :param save_path: Destination path of the download.
+        :param metadata: Torrent metadata of the file.
+        :param have: Chunk indices already written and verified.
+        :param peers: Peers known to hold the file.
+        :param interval: Minimum seconds between two writes of the state file.
+        """
+        self.path = path
+        self.filename = filename
+        self.save_path = save_path
+        self.metadata = metadata
+        self.have = set(have)
+        self.peers = list(peers)
+        self.interval = interval
+        self.saved = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Đọc một tệp trạng thái; trả về None nếu không có hoặc không đọc được.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return cls(
+                path, data["filename"], data["save_path"], data["metadata"],
+                decode_bitfield(bytes.fromhex(data["have"])), data.get("peers", ())
+            )
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable download state '{path}': {e}")
+            return None
+
+    def mark_have(self, chunk_index):
+        """
+        Ghi nhận một chunk đã được ghi xong; tệp trạng thái được lưu lại nếu đã quá `interval` giây.
+        """
+        with self.lock:
+            self.have.add(chunk_index)
+            due = time.monotonic() - self.saved >= self.interval
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Ghi tệp trạng thái một cách nguyên tử (tệp tạm rồi os.replace).
+        """
+        with self.lock:
+            total_chunks = len(self.metadata["pieces"])
+            data = {
+                "filename": self.filename,
+                "save_path": self.save_path,
+                "metadata": self.metadata,
+                "have": encode_bitfield(self.have, total_chunks).hex(),
+                "peers": self.peers
+            }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_file = f"{self.path}.tmp"
+            try:
+                with open(temp_file, "w") as f:
+                    json.dump(data, f)
+                os.replace(temp_file, self.path)
+            except OSError as e:
+                logging.warning(f"Failed to write download state '{self.path}': {e}")
+            self.saved = time.monotonic()
+
+    def remove(self):
+        """
+        Xóa tệp trạng thái khi lượt tải đã hoàn tất.
+        """
+        with self.lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class ChunkCache:
+    """
+    Lớp này giữ các chunk vừa được đọc trong bộ nhớ theo chiến lược LRU với giới hạn tổng số byte,
+    để các chunk được nhiều peer yêu cầu cùng lúc (ví dụ các chunk đầu của tệp mới) không phải đọc lại từ đĩa.
+    """
+    def __init__(self, budget, min_entries=PEER_CACHE_MIN_CHUNKS):
+        """
+        Khởi tạo cache.
+        :param budget: Maximum number of bytes kept in memory; 0 disables the cache.
+        :param min_entries: Whole chunks are cached only if at least this many fit in the budget,
+                            so that large pieces do not evict each other on every block request.
+        """
+        self.budget = budget
+        self.max_entry = budget // max(1, min_entries)
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Lấy một chunk trong cache và đánh dấu là vừa dùng; trả về None nếu không có.
+        """
+        if not self.budget:
+            return None
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def fits(self, length):
+        """
+        Kiểm tra một chunk dài `length` byte có nên được giữ nguyên cả chunk trong cache hay không.
+        """
+        return 0 < length <= self.max_entry
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, data):
+        """
+        Thêm một chunk vào cache, loại các chunk lâu không dùng nhất cho đến khi đủ chỗ.
+        """
+        if len(data) > self.budget:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """
+        Bỏ mọi chunk của một tệp (khi tệp được ghi lại).
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == path]:
+                self.size -= len(self.entries.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.size, "budget": self.budget
+            }
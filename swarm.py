@@ -0,0 +1,360 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from config import TRACKER_DELTA_HISTORY
+
+
+def chunk_ranges(chunk_indices):
+    """
+    Gộp các chỉ số chunk thành các dải liên tiếp [start, end] (bao gồm cả hai đầu).
+    """
+    ranges = []
+    for chunk_index in sorted(chunk_indices):
+        if ranges and ranges[-1][1] == chunk_index - 1:
+            ranges[-1][1] = chunk_index
+        else:
+            ranges.append([chunk_index, chunk_index])
+    return ranges
+
+
+def expand_ranges(ranges, total_chunks):
+    """
+    Trải các dải [start, end] thành từng chỉ số chunk, cắt theo số chunk của tệp.
+    """
+    for start, end in ranges:
+        yield from range(max(0, start), min(end, total_chunks - 1) + 1)
+
+
+class FileSwarm:
+    """
+    Lớp này lưu các peer đang giữ một tệp: tập seeder (giữ đủ mọi chunk)
+    và bitfield cho từng peer chỉ giữ một phần, kèm số nguồn đã tính sẵn của mỗi chunk.
+    Mỗi thay đổi tăng số phiên bản của tệp và được ghi vào lịch sử ngắn để trả về phần thay đổi.
+    """
+    def __init__(self, total_chunks, history=TRACKER_DELTA_HISTORY, version=0, next_version=None):
+        """
+        Khởi tạo swarm rỗng cho một tệp có `total_chunks` chunk.
+        :param history: Number of recent changes kept for delta queries.
+        :param version: Initial version of the swarm.
+        :param next_version: Callable () -> new version, shared by every file of the index so that versions
+                             keep increasing when a file is removed and registered again.
+        """
+        self.total_chunks = total_chunks
+        self.seeders = set()
+        self.partial = {}
+        self.have_counts = {}
+        self.counts = array("I", bytes(4 * total_chunks))
+        self.version = version
+        self.history_start = version
+        self.next_version = next_version
+        self.changes = deque(maxlen=history)
+        self.responses = {}
+
+    def changed(self, kind, peer_id, chunk_indices=None):
+        """
+        Tăng phiên bản, ghi thay đổi vào lịch sử và bỏ các phản hồi đã tuần tự hóa sẵn.
+        :param kind: "seeder", "chunks" (with the chunks the peer gained) or "removed".
+        """
+        if len(self.changes) == self.changes.maxlen:
+            self.history_start = self.changes[0][0]
+        self.version = self.next_version() if self.next_version else self.version + 1
+        self.changes.append((self.version, kind, peer_id, chunk_indices))
+        self.responses.clear()
+
+    def changes_since(self, version):
+        """
+        Các thay đổi sau một phiên bản, hoặc None nếu lịch sử không còn đủ để dựng lại.
+        """
+        if not self.history_start <= version <= self.version:
+            return None
+        return [change for change in self.changes if change[0] > version]
+
+    def bitfield_size(self):
+        return (self.total_chunks + 7) // 8
+
+    @staticmethod
+    def has_bit(bitfield, chunk_index):
+        return bitfield[chunk_index >> 3] & (0x80 >> (chunk_index & 7))
+
+    def availability(self, chunk_index):
+        """
+        Số peer đang giữ một chunk.
+        """
+        return len(self.seeders) + self.counts[chunk_index]
+
+    def add_seeder(self, peer_id):
+        """
+        Đánh dấu một peer giữ đủ mọi chunk; chi phí O(1) nếu peer chưa có bitfield riêng.
+        """
+        if peer_id in self.seeders:
+            return
+        bitfield = self.partial.pop(peer_id, None)
+        if bitfield is not None:
+            self.have_counts.pop(peer_id)
+            for chunk_index in range(self.total_chunks):
+                if self.has_bit(bitfield, chunk_index):
+                    self.counts[chunk_index] -= 1
+        self.seeders.add(peer_id)
+        self.changed("seeder", peer_id)
+
+    def add_chunks(self, peer_id, chunk_indices):
+        """
+        Đánh dấu một peer giữ thêm các chunk; peer được chuyển thành seeder khi đủ mọi chunk.
+        Chỉ số ngoài [0, total_chunks) bị bỏ qua, và peer không có chunk hợp lệ nào không được ghi vào swarm.
+        """
+        if peer_id in self.seeders:
+            return
+        bitfield = self.partial.get(peer_id)
+        added = []
+        for chunk_index in chunk_indices:
+            if not 0 <= chunk_index < self.total_chunks:
+                continue
+            if bitfield is None:
+                bitfield = self.partial[peer_id] = bytearray(self.bitfield_size())
+                self.have_counts[peer_id] = 0
+            elif self.has_bit(bitfield, chunk_index):
+                continue
+            bitfield[chunk_index >> 3] |= 0x80 >> (chunk_index & 7)
+            self.counts[chunk_index] += 1
+            added.append(chunk_index)
+        if bitfield is None:
+            return
+        self.have_counts[peer_id] += len(added)
+        if self.have_counts[peer_id] == self.total_chunks:
+            self.add_seeder(peer_id)
+        elif added:
+            self.changed("chunks", peer_id, added)
+
+    def remove_peer(self, peer_id):
+        """
+        Xóa một peer khỏi swarm. Trả về False nếu peer không giữ chunk nào của tệp.
+        """
+        if peer_id in self.seeders:
+            self.seeders.discard(peer_id)
+        elif peer_id in self.partial:
+            bitfield = self.partial.pop(peer_id)
+            self.have_counts.pop(peer_id)
+            for chunk_index in range(self.total_chunks):
+                if self.has_bit(bitfield, chunk_index):
+                    self.counts[chunk_index] -= 1
+        else:
+            return False
+        self.changed("removed", peer_id)
+        return True
+
+    def is_empty(self):
+        return not self.seeders and not self.partial
+
+    def holders(self, chunk_index):
+        """
+        Danh sách id của các peer đang giữ một chunk.
+        """
+        holders = list(self.seeders)
+        holders.extend(peer_id for peer_id, bitfield in self.partial.items() if self.has_bit(bitfield, chunk_index))
+        return holders
+
+
+class SwarmIndex:
+    """
+    Lớp này là chỉ mục swarm của tracker: bảng địa chỉ peer được intern thành số nguyên
+    và một FileSwarm cho mỗi tệp.
+    """
+    def __init__(self):
+        """
+        Khởi tạo chỉ mục rỗng.
+        """
+        self.peers = []
+        self.peer_ids = {}
+        self.files = {}
+        self.names = []
+        self.peer_files = {}
+        self.version = 0
+
+    def next_version(self):
+        self.version += 1
+        return self.version
+
+    def add_file(self, filename, total_chunks):
+        """
+        Tạo swarm rỗng cho một tệp mới và thêm tên tệp vào danh sách đã sắp xếp.
+        Phiên bản của swarm mới lớn hơn mọi phiên bản đã cấp, kể cả của tệp cùng tên đã bị xóa.
+        """
+        swarm = self.files[filename] = FileSwarm(total_chunks, version=self.next_version(), next_version=self.next_version)
+        insort(self.names, filename)
+        return swarm
+
+    def remove_file(self, filename):
+        del self.files[filename]
+        del self.names[bisect_left(self.names, filename)]
+
+    def remove_peer(self, peer):
+        """
+        Xóa một peer khỏi mọi tệp mà nó đang giữ; tệp không còn peer nào cũng bị xóa.
+        :return: List of affected filenames.
+        """
+        peer_id = self.peer_ids.get(peer)
+        filenames = self.peer_files.pop(peer_id, set()) if peer_id is not None else set()
+        for filename in filenames:
+            swarm = self.files.get(filename)
+            if swarm is None:
+                continue
+            swarm.remove_peer(peer_id)
+            if swarm.is_empty():
+                self.remove_file(filename)
+        return sorted(filenames)
+
+    def intern_peer(self, peer):
+        """
+        Trả về id số nguyên của một địa chỉ peer, cấp id mới nếu chưa có.
+        """
+        peer_id = self.peer_ids.get(peer)
+        if peer_id is None:
+            peer_id = self.peer_ids[peer] = len(self.peers)
+            self.peers.append(peer)
+        return peer_id
+
+    def register(self, filename, total_chunks, peer):
+        """
+        Ghi nhận một peer giữ đủ mọi chunk của tệp, tạo swarm cho tệp nếu chưa có.
+        """
+        swarm = self.files.get(filename)
+        if swarm is None:
+            swarm = self.add_file(filename, total_chunks)
+        peer_id = self.intern_peer(peer)
+        swarm.add_seeder(peer_id)
+        self.peer_files.setdefault(peer_id, set()).add(filename)
+
+    def update(self, filename, chunk_indices, peer, total_chunks=None):
+        """
+        Ghi nhận các chunk mà một peer vừa có. Nếu biết `total_chunks`, swarm của tệp được tạo khi chưa có;
+        ngược lại trả về False nếu tệp chưa được đăng ký.
+        """
+        swarm = self.files.get(filename)
+        if swarm is None and total_chunks is not None:
+            swarm = self.add_file(filename, total_chunks)
+        if swarm is None:
+            return False
+        peer_id = self.intern_peer(peer)
+        swarm.add_chunks(peer_id, chunk_indices)
+        self.peer_files.setdefault(peer_id, set()).add(filename)
+        return True
+
+    def apply(self, record):
+        """
+        Áp dụng một bản ghi journal (register, announce, update hoặc evict).
+        """
+        if record["op"] == "evict":
+            self.remove_peer(record["peer"])
+        elif record["op"] == "register":
+            self.register(record["filename"], record["total_chunks"], record["peer"])
+        elif record["op"] == "announce":
+            total_chunks = record["total_chunks"]
+            self.update(record["filename"], expand_ranges(record["ranges"], total_chunks), record["peer"], total_chunks)
+        else:
+            self.update(record["filename"], record["chunks"], record["peer"])
+
+    def file_info(self, filename):
+        """
+        Trả về danh sách peer giữ từng chunk dạng {chunk_index: [peer, ...]}, hoặc None nếu không có tệp.
+        """
+        swarm = self.files.get(filename)
+        if swarm is None:
+            return None
+        seeders = [self.peers[peer_id] for peer_id in swarm.seeders]
+        partial = [(self.peers[peer_id], bitfield) for peer_id, bitfield in swarm.partial.items()]
+        return {
+            chunk_index: seeders + [peer for peer, bitfield in partial if FileSwarm.has_bit(bitfield, chunk_index)]
+            for chunk_index in range(swarm.total_chunks)
+        }
+
+    def list_files(self, prefix="", contains=None, after=None, limit=None):
+        """
+        Liệt kê tên tệp theo thứ tự, tìm theo tiền tố (tra nhị phân trên danh sách đã sắp xếp)
+        và/hoặc chuỗi con, bắt đầu sau con trỏ `after`.
+        :return: (list of filenames, cursor for the next page or None).
+        """
+        names = self.names
+        position = bisect_left(names, prefix)
+        if after is not None:
+            position = max(position, bisect_right(names, after))
+        result = []
+        while position < len(names) and names[position].startswith(prefix):
+            filename = names[position]
+            position += 1
+            if contains and contains not in filename:
+                continue
+            result.append(filename)
+            if limit is not None and len(result) >= limit:
+                break
+        more = position < len(names) and names[position].startswith(prefix)
+        return result, (result[-1] if more and result else None)
+
+    def peer_set(self, filename):
+        """
+        Trả về (số chunk, danh sách mọi peer giữ tệp, seeder trước) hoặc None nếu không có tệp.
+        """
+        swarm = self.files.get(filename)
+        if swarm is None:
+            return None
+        peer_ids = list(swarm.seeders) + list(swarm.partial)
+        return swarm.total_chunks, [self.peers[peer_id] for peer_id in peer_ids]
+
+    def delta(self, filename, version):
+        """
+        Phần thay đổi của một tệp sau phiên bản `version`. Peer bị xóa được áp dụng trước,
+        các chunk và seeder mới sau đó.
+        :return: (removed peers, new seeders, {peer: [chunk_index, ...]})
+                 or None if the history does not reach back that far.
+        """
+        changes = self.files[filename].changes_since(version)
+        if changes is None:
+            return None
+        removed = {}
+        seeders = {}
+        chunks = {}
+        for _, kind, peer_id, chunk_indices in changes:
+            peer = self.peers[peer_id]
+            if kind == "removed":
+                removed[peer] = True
+                seeders.pop(peer, None)
+                chunks.pop(peer, None)
+            elif kind == "seeder":
+                seeders[peer] = True
+            else:
+                chunks.setdefault(peer, []).extend(chunk_indices)
+        return list(removed), list(seeders), chunks
+
+    def to_dict(self):
+        """
+        Chuyển chỉ mục thành dạng JSON để ghi snapshot.
+        """
+        return {
+            filename: {
+                "total_chunks": swarm.total_chunks,
+                "seeders": [self.peers[peer_id] for peer_id in swarm.seeders],
+                "partial": {self.peers[peer_id]: bitfield.hex() for peer_id, bitfield in swarm.partial.items()},
+            }
+            for filename, swarm in self.files.items()
+        }
+
+    @classmethod
+    def from_dict(cls, files):
+        """
+        Dựng lại chỉ mục từ snapshot; hỗ trợ cả định dạng cũ {filename: {chunk_index: [peer, ...]}}.
+        """
+        index = cls()
+        for filename, data in files.items():
+            if "total_chunks" not in data:
+                index.add_file(filename, len(data))
+                for chunk_index, peers in data.items():
+                    for peer in peers:
+                        index.update(filename, [int(chunk_index)], peer)
+                continue
+
+            for peer in data["seeders"]:
+                index.register(filename, data["total_chunks"], peer)
+            for peer, bitfield_hex in data["partial"].items():
+                bitfield = bytes.fromhex(bitfield_hex)
+                chunk_indices = [i for i in range(data["total_chunks"]) if FileSwarm.has_bit(bitfield, i)]
+                index.update(filename, chunk_indices, peer, data["total_chunks"])
+        return index
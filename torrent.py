@@ -2,44 +2,150 @@ import os
 import hashlib
 import json
 import logging
-from config import TORRENT_MAX_SIZE_KB
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from storage import FileLayout
+from config import (
+    TORRENT_MIN_PIECE_SIZE_KB, TORRENT_MAX_SIZE_KB, TORRENT_TARGET_PIECES,
+    TORRENT_HASH_WORKERS, TORRENT_HASH_READ_SIZE_KB, TORRENT_HASH_CACHE
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+
+class HashCache:
+    """
+    Lớp này lưu danh sách hash của các tệp đã chia sẻ trên đĩa,
+    để chia sẻ lại một tệp không đổi mà không phải băm lại.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, cache_file=TORRENT_HASH_CACHE):
+        """
+        Khởi tạo bộ đệm hash với đường dẫn tệp cache. Tệp cache chỉ được đọc một lần (ở lần get đầu tiên)
+        và các mục mới được giữ trong bộ nhớ cho đến khi flush, nên chia sẻ N tệp chỉ đọc và ghi cache một lần.
+        """
+        self.cache_file = cache_file
+        self.entries = None
+        self.dirty = {}
+
+    @staticmethod
+    def file_key(filepath, files=None):
+        """
+        Tạo khóa nhận diện phiên bản hiện tại của tệp: kích thước, thời gian sửa đổi và inode.
+        Với thư mục, khóa gồm tổng kích thước, thời gian sửa đổi mới nhất và hash của bảng tệp.
+        :param files: File table of a directory torrent; None for a single file.
+        """
+        if files is not None:
+            mtime_ns = max((os.stat(path).st_mtime_ns for path in FileLayout(filepath, files).paths()), default=0)
+            table = hashlib.sha1(json.dumps(files).encode()).hexdigest()
+            return {"size": sum(entry["size"] for entry in files), "mtime_ns": mtime_ns, "table": table}
+        stat = os.stat(filepath)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable hash cache '{self.cache_file}': {e}")
+            return {}
+
+    def get(self, filepath, piece_size, file_key):
+        """
+        Lấy danh sách hash đã lưu nếu tệp chưa thay đổi kể từ lần băm trước.
+        """
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            entry = self.entries.get(os.path.abspath(filepath))
+        if entry and entry.get("piece_size") == piece_size and entry.get("key") == file_key:
+            return entry["pieces"]
+        return None
+
+    def put(self, filepath, piece_size, file_key, pieces):
+        """
+        Ghi nhận danh sách hash của tệp trong bộ nhớ; gọi flush để lưu xuống đĩa.
+        """
+        entry = {"key": file_key, "piece_size": piece_size, "pieces": pieces}
+        with self.lock:
+            self.dirty[os.path.abspath(filepath)] = entry
+            if self.entries is not None:
+                self.entries[os.path.abspath(filepath)] = entry
+
+    def flush(self):
+        """
+        Lưu các mục mới vào tệp cache, ghi nguyên tử bằng tệp tạm và os.replace.
+        Tệp được đọc lại ngay trước khi ghi để không làm mất mục do tiến trình khác thêm vào.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            cache = self.load()
+            cache.update(self.dirty)
+            self.dirty = {}
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_file = f"{self.cache_file}.tmp"
+            try:
+                with open(temp_file, "w") as f:
+                    json.dump(cache, f)
+                os.replace(temp_file, self.cache_file)
+            except OSError as e:
+                logging.warning(f"Failed to write hash cache '{self.cache_file}': {e}")
+
 class Torrent:
     """
     Lớp này cung cấp các tiện ích để tạo và phân tích tệp .torrent.
     """
     @staticmethod
-    def create_torrent(filepath, tracker_ip, tracker_port, piece_size=None):
+    def create_torrent(filepath, tracker_ip, tracker_port, piece_size=None, hash_cache=None):
         """
-        Tạo một tệp metadata .torrent cho tệp được chỉ định.
-        :param filepath: Path to the file to be shared.
+        Tạo một tệp metadata .torrent cho tệp được chỉ định. Với một thư mục, mọi tệp bên trong được nối
+        thành một dòng byte duy nhất và metadata có thêm bảng tệp "files" (đường dẫn, kích thước, offset).
+        :param filepath: Path to the file or directory to be shared.
         :param tracker_ip: IP address of the tracker.
         :param tracker_port: Port of the tracker.
-        :param piece_size: Size of each piece in bytes (default: 1 MB).
+        :param piece_size: Size of each piece in bytes (default: chosen from the file size).
+        :param hash_cache: HashCache shared by a batch of files; the caller flushes it.
+                           Default: a private cache flushed before returning.
         :return: Metadata dictionary.
         """
         if not os.path.exists(filepath):
             logging.error(f"File '{filepath}' does not exist.")
             raise FileNotFoundError(f"File '{filepath}' does not exist.")
 
-        piece_size = piece_size or (TORRENT_MAX_SIZE_KB * 1024)
+        filename = os.path.basename(os.path.normpath(filepath))
+        files = FileLayout.scan(filepath) if os.path.isdir(filepath) else None
+        source = FileLayout(filepath, files) if files is not None else filepath
+        file_size = source.size if files is not None else os.path.getsize(filepath)
+        piece_size = piece_size or Torrent.piece_size_for(file_size)
         if piece_size > TORRENT_MAX_SIZE_KB * 1024:
             piece_size = TORRENT_MAX_SIZE_KB * 1024
             logging.warning(f"Piece size exceeds maximum allowed size. Using {piece_size} bytes.")
 
-        filename = os.path.basename(filepath)
-        file_size = os.path.getsize(filepath)
-        pieces = []
+        cache = hash_cache or HashCache()
+        file_key = HashCache.file_key(filepath, files)
+        pieces = cache.get(filepath, piece_size, file_key)
 
-        try:
-            with open(filepath, "rb") as f:
-                while chunk := f.read(piece_size):
-                    pieces.append(hashlib.sha1(chunk).hexdigest())
-        except Exception as e:
-            logging.error(f"Error reading file '{filepath}': {e}")
-            raise
+        if pieces is not None:
+            logging.info(f"Using cached piece hashes for '{filepath}'.")
+        else:
+            try:
+                pieces = Torrent.hash_pieces(source, piece_size)
+            except Exception as e:
+                logging.error(f"Error reading file '{filepath}': {e}")
+                raise
+            if HashCache.file_key(filepath, files) == file_key:
+                cache.put(filepath, piece_size, file_key, pieces)
+                if hash_cache is None:
+                    cache.flush()
+            else:
+                logging.warning(f"File '{filepath}' changed while hashing; not caching its hashes.")
 
         metadata = {
             "filename": filename,
@@ -48,6 +154,8 @@ class Torrent:
             "pieces": pieces,
             "tracker": f"{tracker_ip}:{tracker_port}"
         }
+        if files is not None:
+            metadata["files"] = files
 
         torrent_file = os.path.join("data", f"{filename}.torrent")
         os.makedirs("data", exist_ok=True)
@@ -61,6 +169,73 @@ class Torrent:
 
         return metadata
 
+    @staticmethod
+    def piece_size_for(file_size):
+        """
+        Chọn kích thước piece theo kích thước tệp để số piece (và trạng thái trên tracker) có giới hạn:
+        lũy thừa của 2 nhỏ nhất, trong khoảng [TORRENT_MIN_PIECE_SIZE_KB, TORRENT_MAX_SIZE_KB],
+        sao cho tệp có không quá TORRENT_TARGET_PIECES piece.
+        """
+        piece_size = TORRENT_MIN_PIECE_SIZE_KB * 1024
+        while piece_size < TORRENT_MAX_SIZE_KB * 1024 and file_size > piece_size * TORRENT_TARGET_PIECES:
+            piece_size *= 2
+        return piece_size
+
+    @staticmethod
+    def hash_pieces(filepath, piece_size, workers=TORRENT_HASH_WORKERS, read_size=TORRENT_HASH_READ_SIZE_KB * 1024):
+        """
+        Tính hash SHA-1 của từng piece song song trên nhiều luồng.
+        Tệp được đọc tuần tự theo khối lớn; hashlib nhả GIL nên các luồng băm chạy song song thật sự.
+        :param filepath: Path to the file, or the FileLayout of a directory torrent.
+        :param piece_size: Size of each piece in bytes.
+        :param workers: Number of hashing threads.
+        :param read_size: Size of each sequential read, rounded to whole pieces.
+        :return: List of hex SHA-1 digests, one per piece.
+        """
+        pieces_per_read = max(1, read_size // piece_size)
+        read_size = pieces_per_read * piece_size
+        max_pending = max(2 * workers, 2 * pieces_per_read)
+        pieces = []
+        pending = deque()
+
+        stream = filepath.open() if isinstance(filepath, FileLayout) else open(filepath, "rb")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor, stream as f:
+            while block := f.read(read_size):
+                view = memoryview(block)
+                for start in range(0, len(view), piece_size):
+                    pending.append(executor.submit(Torrent.sha1_hex, view[start:start + piece_size]))
+                while len(pending) > max_pending:
+                    pieces.append(pending.popleft().result())
+            pieces.extend(future.result() for future in pending)
+        return pieces
+
+    @staticmethod
+    def verify_pieces(filepath, piece_size, pieces, chunk_indices, workers=TORRENT_HASH_WORKERS):
+        """
+        Kiểm tra lại song song hash của một số piece trong tệp, ví dụ khi tiếp tục một lượt tải bị gián đoạn.
+        :param filepath: Path to the file, or the FileLayout of a directory torrent.
+        :param pieces: Expected hex SHA-1 digests, one per piece.
+        :param chunk_indices: Indices of the pieces to check.
+        :return: Set of indices whose data matches the expected hash.
+        """
+        def check(chunk_index):
+            if isinstance(filepath, FileLayout):
+                data = filepath.read(chunk_index * piece_size, piece_size)
+            else:
+                with open(filepath, "rb") as f:
+                    f.seek(chunk_index * piece_size)
+                    data = f.read(piece_size)
+            return data and Torrent.sha1_hex(data) == pieces[chunk_index]
+
+        chunk_indices = [index for index in chunk_indices if 0 <= index < len(pieces)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(check, chunk_indices)
+            return {chunk_index for chunk_index, valid in zip(chunk_indices, results) if valid}
+
+    @staticmethod
+    def sha1_hex(data):
+        return hashlib.sha1(data).hexdigest()
+
     @staticmethod
     def parse_torrent(torrent_file):
         """
@@ -1,9 +1,20 @@
-import socket
+import asyncio
 import threading
+import heapq
+import time
+import uuid
 import json
 import logging
-import os
 from colorama import Fore, Style
+from config import (
+    TRACKER_BACKLOG, TRACKER_MAX_CONNECTIONS, TRACKER_REQUEST_TIMEOUT, TRACKER_MAX_REQUEST_SIZE,
+    TRACKER_SNAPSHOT_FILE, TRACKER_JOURNAL_FILE, TRACKER_LIST_LIMIT, TRACKER_LIST_MAX_LIMIT,
+    TRACKER_PEER_TTL, TRACKER_EXPIRY_INTERVAL, TRACKER_FAILURE_REPORTS, TRACKER_IDLE_TIMEOUT, TRACKER_MAX_CHUNKS
+)
+from journal import TrackerJournal
+from metrics import Metrics
+from swarm import SwarmIndex, chunk_ranges
+from protocol import encode_tracker_frame, parse_peer_address, TRACKER_FRAME
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,121 +23,310 @@ logging.basicConfig(
 
 logging.info("Tracker logging initialized.")
 
+# Actions counted under their own label in the request metrics; anything else is "unknown".
+ACTIONS = ("heartbeat", "register", "query", "list_files", "update", "announce", "stats")
+
 class Tracker:
     """
     Lớp này đại diện cho Tracker, quản lý metadata của các tệp và thông tin của các peer.
     """
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, backlog=TRACKER_BACKLOG, max_connections=TRACKER_MAX_CONNECTIONS,
+                 request_timeout=TRACKER_REQUEST_TIMEOUT, max_request_size=TRACKER_MAX_REQUEST_SIZE,
+                 peer_ttl=TRACKER_PEER_TTL):
         """
-        Khởi tạo Tracker với địa chỉ IP và cổng.
+        Khởi tạo Tracker với địa chỉ IP, cổng và các giới hạn kết nối.
+        :param peer_ttl: Seconds without a heartbeat or announce after which a peer is evicted.
         """
         self.ip = ip
         self.port = port
-        self.files = {}
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.max_request_size = max_request_size
+        self.active_connections = 0
+        self.peer_ttl = peer_ttl
+        self.last_seen = {}
+        self.expiry = []
+        self.expiry_scheduled = set()
+        self.failure_reports = {}
+        self.swarm = SwarmIndex()
+        self.epoch = uuid.uuid4().hex[:8]
         self.lock = threading.Lock()
-        self.temp_file = "temp.json"
-        self.load_files_from_temp()
+        self.metrics = Metrics("tracker")
+        self.metrics.gauge("connections", lambda: self.active_connections)
+        self.metrics.gauge("swarm", self.swarm_gauges)
+        self.journal = TrackerJournal(TRACKER_SNAPSHOT_FILE, TRACKER_JOURNAL_FILE, metrics=self.metrics)
+        self.load_state()
 
-    def load_files_from_temp(self):
+    def load_state(self):
         """
-        Tải dữ liệu tạm thời từ tệp temp.json nếu tồn tại.
+        Khôi phục trạng thái từ snapshot và journal, rồi bật việc gộp snapshot ở nền.
         """
-        if os.path.exists(self.temp_file):
-            try:
-                with open(self.temp_file, "r") as f:
-                    self.files = json.load(f)
-                logging.info("Loaded tracker data from temp.json.")
-            except Exception as e:
-                logging.error(f"Failed to load tracker data from temp.json: {e}")
+        files, records = self.journal.recover()
+        self.swarm = SwarmIndex.from_dict(files)
+        self.journal.open(self.apply, records)
+        if records:
+            logging.info(f"Replayed {len(records)} journal records.")
+        for peer_id in self.swarm.peer_files:
+            self.touch(self.swarm.peers[peer_id])
+        self.journal.start_compaction(SwarmIndex.from_dict(files))
+
+    def swarm_gauges(self):
+        """
+        Kích thước swarm hiện tại: số tệp, số peer còn sống, tổng số cặp (tệp, peer) và swarm lớn nhất.
+        """
+        with self.lock:
+            sizes = [len(swarm.seeders) + len(swarm.partial) for swarm in self.swarm.files.values()]
+            return {
+                "files": len(sizes), "peers": len(self.last_seen),
+                "peer_entries": sum(sizes), "largest": max(sizes, default=0)
+            }
 
-    def save_files_to_temp(self):
+    def apply(self, record):
         """
-        Lưu dữ liệu hiện tại vào tệp temp.json.
+        Áp dụng một bản ghi thay đổi vào trạng thái trong bộ nhớ.
+        Dùng chung cho yêu cầu mới và khi phát lại journal.
         """
-        try:
-            with open(self.temp_file, "w") as f:
-                json.dump(self.files, f)
-            logging.info("Saved tracker data to temp.json.")
-        except Exception as e:
-            logging.error(f"Failed to save tracker data to temp.json: {e}")
+        self.swarm.apply(record)
 
-    def handle_client(self, conn, addr):
+    def touch(self, peer):
         """
-        Xử lý yêu cầu từ một peer client.
+        Ghi nhận peer vừa liên lạc với tracker. Mỗi peer chỉ có một mục trong heap hết hạn;
+        mục đó được dời lại khi tới hạn nếu peer đã liên lạc sau đó. Gọi khi đang giữ self.lock.
         """
-        logging.info(f"New connection from {addr}")
-        try:
-            data = self.receive_data(conn)
-            logging.info(f"Received raw data from {addr}: {data}")
-            if not data:
-                logging.warning(f"Empty request from {addr}")
-                response = {"status": "error", "message": "Empty request"}
-                conn.send(json.dumps(response).encode())
+        now = time.monotonic()
+        self.last_seen[peer] = now
+        self.failure_reports.pop(peer, None)
+        if peer not in self.expiry_scheduled:
+            self.expiry_scheduled.add(peer)
+            heapq.heappush(self.expiry, (now + self.peer_ttl, peer))
+
+    def expire_peers(self):
+        """
+        Loại các peer đã quá TTL không gửi heartbeat hay announce khỏi mọi tệp.
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now:
+                _, peer = heapq.heappop(self.expiry)
+                last_seen = self.last_seen.get(peer)
+                if last_seen is None:
+                    self.expiry_scheduled.discard(peer)
+                elif last_seen + self.peer_ttl > now:
+                    heapq.heappush(self.expiry, (last_seen + self.peer_ttl, peer))
+                else:
+                    self.expiry_scheduled.discard(peer)
+                    self.evict(peer, f"no heartbeat for {self.peer_ttl}s")
+
+    def report_failed(self, peers, reporter):
+        """
+        Ghi nhận các peer mà một peer khác không kết nối được; peer bị loại khi đủ số máy báo cáo.
+        Chỉ nhận báo cáo từ peer đang giữ tệp trên tracker, và đếm theo địa chỉ IP của người báo cáo
+        (cổng do client tự khai nên một máy không thể tự đủ số báo cáo).
+        """
+        if not isinstance(peers, list):
+            return
+        reporter_ip = parse_peer_address(reporter, 0)[0]
+        with self.lock:
+            if self.swarm.peer_ids.get(reporter) not in self.swarm.peer_files:
                 return
+            for peer in peers:
+                if not isinstance(peer, str) or peer not in self.swarm.peer_ids:
+                    continue
+                if parse_peer_address(peer, 0)[0] == reporter_ip:
+                    continue
+                reporters = self.failure_reports.setdefault(peer, set())
+                reporters.add(reporter_ip)
+                if len(reporters) >= TRACKER_FAILURE_REPORTS:
+                    self.evict(peer, f"reported unreachable by {len(reporters)} hosts")
+
+    def evict(self, peer, reason):
+        """
+        Xóa một peer khỏi mọi tệp và ghi lại vào journal. Gọi khi đang giữ self.lock.
+        """
+        self.last_seen.pop(peer, None)
+        self.failure_reports.pop(peer, None)
+        record = {"op": "evict", "peer": peer}
+        self.apply(record)
+        self.journal.append(record)
+        logging.info(f"Evicted peer {peer}: {reason}.")
+
+    async def expire_loop(self):
+        while True:
+            await asyncio.sleep(TRACKER_EXPIRY_INTERVAL)
+            self.expire_peers()
 
-            action = data.get("action")
+    async def handle_connection(self, reader, writer):
+        """
+        Xử lý một kết nối từ peer client trên vòng lặp sự kiện. Kết nối có thể là một phiên lâu dài
+        gồm nhiều khung yêu cầu (mỗi khung kèm request id), hoặc một yêu cầu JSON trần như trước.
+        """
+        addr = writer.get_extra_info("peername")
+        if self.active_connections >= self.max_connections:
+            logging.warning(f"Rejecting connection from {addr}: {self.active_connections} connections open")
+            writer.write(encode_tracker_frame(0, {"status": "error", "message": "Tracker busy"}))
+            writer.close()
+            return
+
+        self.active_connections += 1
+        logging.debug(f"New connection from {addr}")
+        try:
+            header = await asyncio.wait_for(reader.readexactly(TRACKER_FRAME.size), self.request_timeout)
+            if header.startswith(b"{"):
+                await self.handle_single_request(reader, writer, addr, header)
+                return
 
-            if action == "register":
-                response = self.register_file(data, addr[0])
-            elif action == "query":
-                response = self.query_file(data)
-            elif action == "list_files":
-                response = self.list_files()
-            elif action == "update":
-                response = self.update_chunks(data, addr[0])
-            else:
-                response = {"status": "error", "message": "Unknown action"}
-                logging.warning(f"Unknown action '{action}' from {addr}")
-
-            conn.send(json.dumps(response).encode())
-            logging.info(f"Response sent to peer {addr}: {response}")
-        except json.JSONDecodeError:
-            logging.error(f"Malformed request from {addr}")
-            response = {"status": "error", "message": "Malformed request"}
-            conn.send(json.dumps(response).encode())
+            while True:
+                length, request_id = TRACKER_FRAME.unpack(header)
+                if length > self.max_request_size:
+                    logging.error(f"Request of {length} bytes from {addr} exceeds the limit")
+                    break
+                payload = await asyncio.wait_for(reader.readexactly(length), self.request_timeout)
+                try:
+                    request = json.loads(payload)
+                except ValueError:
+                    logging.error(f"Malformed request from {addr}")
+                    response = {"status": "error", "message": "Malformed request"}
+                else:
+                    logging.debug(f"Received request {request_id} from {addr}: {request}")
+                    response = await self.process_request(request, addr)
+
+                writer.write(encode_tracker_frame(request_id, response))
+                await asyncio.wait_for(writer.drain(), self.request_timeout)
+                header = await asyncio.wait_for(reader.readexactly(TRACKER_FRAME.size), TRACKER_IDLE_TIMEOUT)
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.TimeoutError:
+            logging.debug(f"Connection from {addr} idle, closing")
         except Exception as e:
             logging.error(f"Error handling client {addr}: {e}")
-            response = {"status": "error", "message": str(e)}
-            conn.send(json.dumps(response).encode())
         finally:
-            conn.close()
-            logging.info(f"Connection with {addr} closed")
+            self.active_connections -= 1
+            writer.close()
+            logging.debug(f"Connection with {addr} closed")
 
-    def receive_data(self, conn):
+    async def handle_single_request(self, reader, writer, addr, prefix):
         """
-        Nhận dữ liệu từ kết nối socket.
+        Xử lý một yêu cầu JSON không đóng khung (client cũ): đọc, trả lời một lần rồi đóng.
         """
-        buffer_size = 1024
-
         try:
-            metadata = conn.recv(buffer_size).decode()
-            logging.info(f"Received metadata: {metadata}")
+            request = await asyncio.wait_for(self.read_request(reader, prefix), self.request_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Request from {addr} timed out")
+            response = {"status": "error", "message": "Request timed out"}
+        except ValueError:
+            logging.error(f"Malformed request from {addr}")
+            response = {"status": "error", "message": "Malformed request"}
+        else:
+            logging.debug(f"Received request from {addr}: {request}")
+            response = await self.process_request(request, addr)
 
-            metadata_json = json.loads(metadata)
-            total_chunks = metadata_json.get("total_chunks")
-            filename = metadata_json.get("filename")
-            peer_ip = metadata_json.get("peer_ip")
+        writer.write(encode_tracker_frame(0, response))
+        await asyncio.wait_for(writer.drain(), self.request_timeout)
+
+    async def read_request(self, reader, buffer=b""):
+        """
+        Đọc một yêu cầu JSON từ kết nối cho đến khi nhận đủ một đối tượng hoàn chỉnh.
+        :param buffer: Bytes of the request already read from the connection.
+        """
+        try:
+            return json.loads(buffer)
+        except ValueError:
+            pass
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            buffer += data
+            if len(buffer) > self.max_request_size:
+                raise ValueError("Request too large")
+            try:
+                return json.loads(buffer)
+            except ValueError:
+                continue
+        if not buffer:
+            return None
+        return json.loads(buffer)
 
-            if filename == "unknown" or peer_ip == "unknown":
-                logging.warning(f"Invalid metadata received: filename='{filename}', peer_ip='{peer_ip}'")
-                return None
+    async def process_request(self, request, addr):
+        """
+        Kiểm tra và chạy một yêu cầu.
+        """
+        if not isinstance(request, dict):
+            logging.warning(f"Empty request from {addr}")
+            return {"status": "error", "message": "Empty request"}
+        return self.dispatch(request, addr)
 
-            logging.info(f"Registering file '{filename}' with {total_chunks} chunks from peer {peer_ip}.")
+    def dispatch(self, request, addr):
+        """
+        Chuyển yêu cầu tới hàm xử lý tương ứng với action, đếm số yêu cầu và thời gian xử lý theo action.
+        """
+        started = time.perf_counter()
+        action = request.get("action")
+        response = self.handle_action(action, request, addr)
+        label = action if action in ACTIONS else "unknown"
+        self.metrics.observe("request_seconds", time.perf_counter() - started, action=label)
+        self.metrics.inc("requests_total", action=label)
+        if isinstance(response, dict) and response.get("status") == "error":
+            self.metrics.inc("request_errors_total", action=label)
+        return response
 
-            with self.lock:
-                if filename not in self.files:
-                    self.files[filename] = {i: [] for i in range(total_chunks)}
+    def handle_action(self, action, request, addr):
+        try:
+            if isinstance(request.get("peer_port"), int):
+                with self.lock:
+                    self.touch(self.peer_address(request, addr[0]))
+            if request.get("failed"):
+                self.report_failed(request["failed"], self.peer_address(request, addr[0]))
+
+            if action == "heartbeat":
+                return {"status": "success", "interval": max(1, self.peer_ttl // 3)}
+            elif action == "register":
+                return self.register_file(request, self.peer_address(request, addr[0]))
+            elif action == "query":
+                return self.query_file(request)
+            elif action == "list_files":
+                return self.list_files(request)
+            elif action == "update":
+                return self.update_chunks(request, self.peer_address(request, addr[0]))
+            elif action == "announce":
+                return self.announce(request, self.peer_address(request, addr[0]))
+            elif action == "stats":
+                return self.stats(request)
+            logging.warning(f"Unknown action '{action}' from {addr}")
+            return {"status": "error", "message": "Unknown action"}
+        except Exception as e:
+            logging.error(f"Error handling '{action}' from {addr}: {e}")
+            return {"status": "error", "message": str(e)}
 
-                for chunk_index in range(total_chunks):
-                    if peer_ip not in self.files[filename][chunk_index]:
-                        self.files[filename][chunk_index].append(peer_ip)
-                        logging.info(f"Chunk {chunk_index} of file '{filename}' registered for peer {peer_ip}.")
+    def stats(self, request):
+        """
+        Trả về số liệu của tracker: dạng JSON, hoặc văn bản Prometheus khi yêu cầu có "format": "prometheus".
+        """
+        if request.get("format") == "prometheus":
+            return {"status": "success", "text": self.metrics.prometheus()}
+        return {"status": "success", "metrics": self.metrics.snapshot()}
 
-            return metadata_json
+    def peer_address(self, request, peer_ip):
+        """
+        Ghép địa chỉ IP của peer với cổng lắng nghe mà peer gửi lên (nếu có).
+        """
+        peer_port = request.get("peer_port")
+        if isinstance(peer_port, int):
+            return f"{peer_ip}:{peer_port}"
+        return peer_ip
 
-        except Exception as e:
-            logging.error(f"Error while receiving data: {e}")
-            return None
+    @staticmethod
+    def check_total_chunks(total_chunks):
+        """
+        Kiểm tra số chunk của một tệp do peer gửi lên.
+        :return: Error message, or None if the count is valid.
+        """
+        if not isinstance(total_chunks, int) or isinstance(total_chunks, bool) or total_chunks < 0:
+            return "Invalid chunk count"
+        if total_chunks > TRACKER_MAX_CHUNKS:
+            return f"Too many chunks: {total_chunks} (maximum {TRACKER_MAX_CHUNKS})"
+        return None
 
     def register_file(self, request, peer_ip):
         """
@@ -135,51 +335,139 @@ class Tracker:
         filename = request.get("filename")
         total_chunks = request.get("total_chunks")
 
-        if not filename or filename == "unknown" or not isinstance(total_chunks, int):
+        if not filename or filename == "unknown":
             logging.warning(f"Invalid file registration attempt: filename='{filename}', total_chunks='{total_chunks}'")
             return {"status": "error", "message": "Invalid file registration"}
+        error = self.check_total_chunks(total_chunks)
+        if error:
+            logging.warning(f"Rejected registration of '{filename}' from {peer_ip}: {error}")
+            return {"status": "error", "message": error}
 
+        record = {"op": "register", "filename": filename, "total_chunks": total_chunks, "peer": peer_ip}
         with self.lock:
-            if filename not in self.files:
-                self.files[filename] = {i: [] for i in range(total_chunks)}
-            for chunk_index in range(total_chunks):
-                if peer_ip not in self.files[filename][chunk_index]:
-                    self.files[filename][chunk_index].append(peer_ip)
+            self.apply(record)
+            self.journal.append(record)
 
-        self.save_files_to_temp()
         logging.info(f"File '{filename}' registered with {total_chunks} chunks by {peer_ip}")
         return {"status": "success", "filename": filename}
 
     def query_file(self, request):
         """
-        Truy vấn thông tin về một tệp cụ thể.
+        Truy vấn thông tin về một tệp cụ thể. Với "peers_only", chỉ trả về tập peer ban đầu;
+        peer tự trao đổi bitfield với nhau để biết chunk nào ở đâu.
+        Nếu yêu cầu kèm "epoch" và "if_version" của lần truy vấn trước, tracker trả về "not_modified"
+        hoặc chỉ phần thay đổi ("delta") khi còn đủ lịch sử. Phản hồi đầy đủ được tuần tự hóa một lần
+        cho mỗi phiên bản của tệp.
         """
         filename = request["filename"]
+        kind = "peers" if request.get("peers_only") else "file_info"
+        if_version = request.get("if_version") if request.get("epoch") == self.epoch else None
         with self.lock:
-            file_info = self.files.get(filename, None)
-        if file_info is None:
-            return {"status": "error", "message": "File not found"}
-        return {"status": "success", "file_info": file_info}
+            swarm = self.swarm.files.get(filename)
+            if swarm is None:
+                return {"status": "error", "message": "File not found"}
+            version = swarm.version
+            if if_version == version:
+                return {"status": "not_modified", "epoch": self.epoch, "version": version}
+
+            delta = self.swarm.delta(filename, if_version) if isinstance(if_version, int) else None
+            if delta is not None:
+                removed, seeders, chunks = delta
+                if kind == "peers":
+                    changes = {"removed": removed, "peers": list(dict.fromkeys(seeders + list(chunks)))}
+                else:
+                    changes = {
+                        "removed": removed, "seeders": seeders,
+                        "chunks": {peer: chunk_ranges(indices) for peer, indices in chunks.items()}
+                    }
+                return {
+                    "status": "success", "epoch": self.epoch, "version": version,
+                    "total_chunks": swarm.total_chunks, "delta": changes
+                }
+
+            payload = swarm.responses.get(kind)
+            if payload is None:
+                response = {"status": "success", "epoch": self.epoch, "version": version}
+                if kind == "peers":
+                    response["total_chunks"], response["peers"] = self.swarm.peer_set(filename)
+                else:
+                    response["file_info"] = self.swarm.file_info(filename)
+                payload = swarm.responses[kind] = json.dumps(response).encode()
+        return payload
 
     def update_chunks(self, request, peer_ip):
         """
         Cập nhật thông tin các chunk của tệp từ một peer.
         """
         filename = request["filename"]
-        chunks = request["chunks"]
+        try:
+            chunks = [int(chunk) for chunk in request["chunks"]]
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Invalid chunk index"}
+        record = {"op": "update", "filename": filename, "chunks": chunks, "peer": peer_ip}
         with self.lock:
-            if filename not in self.files:
+            swarm = self.swarm.files.get(filename)
+            if swarm is None:
                 logging.warning(f"File '{filename}' not found in tracker.")
                 return {"status": "error", "message": "File not found"}
+            invalid = [chunk for chunk in chunks if not 0 <= chunk < swarm.total_chunks]
+            if invalid:
+                logging.warning(f"Rejected update of '{filename}' from {peer_ip}: chunks {invalid[:10]} out of range.")
+                return {"status": "error", "message": f"Chunk index out of range [0, {swarm.total_chunks}): {invalid[0]}"}
+            self.apply(record)
+            self.journal.append(record)
+
+        logging.debug(f"Updated chunks for '{filename}' from peer {peer_ip}.")
+        return {"status": "success"}
 
-            for chunk in chunks:
-                chunk_index = int(chunk)
-                if peer_ip not in self.files[filename][chunk_index]:
-                    self.files[filename][chunk_index].append(peer_ip)
+    def announce(self, request, peer_ip):
+        """
+        Ghi nhận trong một yêu cầu nhiều tệp của một peer: tệp đầy đủ hoặc các dải chunk đã có.
+        Mỗi phần tử của "files" có dạng {"filename", "total_chunks", "complete": true}
+        hoặc {"filename", "total_chunks", "chunks": [[start, end], ...]}.
+        """
+        entries = request.get("files")
+        if not isinstance(entries, list):
+            return {"status": "error", "message": "Invalid announce"}
 
-        self.save_files_to_temp()
-        logging.info(f"Updated chunks for '{filename}' from peer {peer_ip}.")
-        return {"status": "success"}
+        accepted = []
+        rejected = {}
+        with self.lock:
+            for entry in entries:
+                filename = entry.get("filename") if isinstance(entry, dict) else None
+                total_chunks = entry.get("total_chunks") if filename else None
+                if not filename:
+                    rejected[str(filename)] = "Invalid entry"
+                    continue
+                error = self.check_total_chunks(total_chunks)
+                if error:
+                    rejected[filename] = error
+                    continue
+                swarm = self.swarm.files.get(filename)
+                if swarm is not None and swarm.total_chunks != total_chunks:
+                    rejected[filename] = "Chunk count mismatch"
+                    continue
+
+                if entry.get("complete"):
+                    record = {"op": "register", "filename": filename, "total_chunks": total_chunks, "peer": peer_ip}
+                else:
+                    ranges = entry.get("chunks", [])
+                    if not all(isinstance(r, list) and len(r) == 2 and all(isinstance(i, int) for i in r) for r in ranges):
+                        rejected[filename] = "Invalid chunk ranges"
+                        continue
+                    if not all(0 <= start <= end < total_chunks for start, end in ranges):
+                        rejected[filename] = f"Chunk range out of range [0, {total_chunks})"
+                        continue
+                    record = {
+                        "op": "announce", "filename": filename, "total_chunks": total_chunks,
+                        "ranges": ranges, "peer": peer_ip
+                    }
+                self.apply(record)
+                self.journal.append(record)
+                accepted.append(filename)
+
+        logging.debug(f"Announce from {peer_ip}: {len(accepted)} files accepted, {len(rejected)} rejected.")
+        return {"status": "success", "files": accepted, "rejected": rejected}
 
     def register_torrent(self, request, peer_ip):
         """
@@ -187,9 +475,13 @@ class Tracker:
         """
         filename = request["filename"]
         pieces = request["pieces"]
+        error = self.check_total_chunks(len(pieces))
+        if error:
+            logging.warning(f"Rejected .torrent file '{filename}' from {peer_ip}: {error}")
+            return {"status": "error", "message": error}
         with self.lock:
-            if filename not in self.files:
-                self.files[filename] = {i: [] for i in range(len(pieces))}
+            if filename not in self.swarm.files:
+                self.swarm.add_file(filename, len(pieces))
         log_message('INFO', f"Registered .torrent file: {filename} from {peer_ip}")
 
     def query_torrent(self, request):
@@ -198,31 +490,47 @@ class Tracker:
         """
         filename = request["filename"]
         with self.lock:
-            response = self.files.get(filename, {})
-        log_message('INFO', f"Query for .torrent file: {filename}")
+            response = self.swarm.file_info(filename) or {}
+        logging.debug(f"Query for .torrent file: {filename}")
         return response
 
-    def list_files(self):
+    def list_files(self, request):
         """
-        Liệt kê tất cả các tệp đã được đăng ký với Tracker.
+        Liệt kê các tệp đã được đăng ký với Tracker theo từng trang.
+        Yêu cầu có thể kèm "prefix", "contains", "after" (tên cuối của trang trước) và "limit";
+        phản hồi có "next" là con trỏ của trang kế tiếp, hoặc null nếu đã hết.
         """
+        prefix = request.get("prefix") or ""
+        contains = request.get("contains") or None
+        after = request.get("after")
+        limit = request.get("limit", TRACKER_LIST_LIMIT)
+        if not isinstance(prefix, str) or not isinstance(contains, (str, type(None))) \
+                or not isinstance(after, (str, type(None))) or not isinstance(limit, int) or limit < 1:
+            return {"status": "error", "message": "Invalid list_files parameters"}
         with self.lock:
-            file_list = list(self.files.keys())
-        return {"status": "success", "files": file_list}
+            file_list, cursor = self.swarm.list_files(prefix, contains, after, min(limit, TRACKER_LIST_MAX_LIMIT))
+        return {"status": "success", "files": file_list, "next": cursor}
 
     def start(self):
         """
         Bắt đầu Tracker và lắng nghe các kết nối từ các peer.
         """
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.bind((self.ip, self.port))
-        server.listen(5)
-        log_message('INFO', f"Tracker running on {self.ip}:{self.port}")
+        asyncio.run(self.serve())
 
-        while True:
-            conn, addr = server.accept()
-            log_message('INFO', f"Connection from {addr}")
-            threading.Thread(target=self.handle_client, args=(conn, addr)).start()
+    async def serve(self):
+        """
+        Chạy máy chủ asyncio của Tracker cho đến khi bị dừng.
+        """
+        server = await asyncio.start_server(
+            self.handle_connection, self.ip, self.port, backlog=self.backlog, reuse_address=True
+        )
+        log_message('INFO', f"Tracker running on {self.ip}:{self.port}")
+        expiry_task = asyncio.create_task(self.expire_loop())
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                expiry_task.cancel()
 
 def log_message(level, message):
     if level == 'INFO':
@@ -239,7 +547,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Tracker Server")
     parser.add_argument("--ip", required=True, help="Tracker IP address")
     parser.add_argument("--port", type=int, required=True, help="Tracker port")
+    parser.add_argument("--backlog", type=int, default=TRACKER_BACKLOG, help="Listen backlog")
+    parser.add_argument("--max-connections", type=int, default=TRACKER_MAX_CONNECTIONS, help="Maximum open connections")
+    parser.add_argument("--timeout", type=float, default=TRACKER_REQUEST_TIMEOUT, help="Per-request timeout in seconds")
+    parser.add_argument("--peer-ttl", type=float, default=TRACKER_PEER_TTL, help="Seconds before a silent peer is evicted")
+    parser.add_argument("--log-level", default="info", help="Log level (debug logs every request)")
     args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level.upper())
 
-    tracker = Tracker(args.ip, args.port)
+    tracker = Tracker(args.ip, args.port, backlog=args.backlog, max_connections=args.max_connections,
+                      request_timeout=args.timeout, peer_ttl=args.peer_ttl)
     tracker.start()